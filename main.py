@@ -1,6 +1,9 @@
 import asyncio
-import uuid
-from telegram import Update, Bot
+try:
+    import uvloop  # Faster event loop; not available on Windows
+except ImportError:
+    uvloop = None
+from telegram import Update
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -9,90 +12,166 @@ from telegram.ext import (
     filters,
     ContextTypes
 )
-from src.config.settings import TELEGRAM_BOT_TOKEN, setup_logging
+from src.config.settings import SCHEDULE_TIMEZONE, TELEGRAM_BOT_TOKEN, setup_logging
 from src.handlers.command_handlers import start, check_progress, mini_lesson
 from src.handlers.callback_handlers import handle_callback
-from src.database.connection import init_db, get_db_session
-from src.utils.openai_tools import OpenAITools
-import schedule
-import time
-from datetime import datetime
+from src.database.connection import init_db, async_engine, get_async_session, pool_status, warm_async_pool
+from datetime import time
+from sqlalchemy import select
 from src.database.models import User
 
 logger = setup_logging()
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+
+# Hours (in SCHEDULE_TIMEZONE) at which scheduled lesson reminders go out
+SCHEDULED_HOURS = (9, 13, 17)
+# Reminder text per message frequency for each scheduled hour; frequencies not
+# listed for an hour get no reminder then
+REMINDER_PLANS = {
+    9: {
+        "once": "Your daily Rust lesson is ready!",
+        "twice": "Your Rust lesson is ready!",
+        "three": "Your Rust lesson is ready!"
+    },
+    13: {"three": "Your Rust lesson is ready!"},
+    17: {
+        "twice": "Your Rust lesson is ready!",
+        "three": "Your Rust lesson is ready!"
+    }
+}
+# Updates in flight at once across all chats (PTB's default for concurrent_updates=True)
+MAX_CONCURRENT_UPDATES = 256
+# Telegram allows bots roughly 30 messages per second across all chats
+SEND_BATCH_SIZE = 30
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle regular text messages from users in the Telegram chat."""
-    if not update.message or not update.message.text or update.message.text.startswith('/'):  
+    """Handle regular text messages from users in the Telegram chat.
+    
+    Commands never reach this handler: it is registered with
+    `filters.TEXT & ~filters.COMMAND`, so PTB drops them before dispatch.
+    """
+    message = update.effective_message
+    text = message.text if message else None
+    if not text:
         return
         
-    openai_tools = OpenAITools()
-    response = openai_tools.chat(str(update.effective_user.id), update.message.text)
-    await update.message.reply_text(response, parse_mode='Markdown')
+    user_id = str(update.effective_user.id)
+    from src.utils.openai_tools import OpenAIToolsError, get_openai_tools  # Deferred: only load the OpenAI SDK once a message arrives
+    try:
+        response = await get_openai_tools().achat(user_id, text)
+    except OpenAIToolsError as e:
+        await message.reply_text(f"❌ Sorry, something went wrong: {e}")
+        return
+    await message.reply_text(response['content'], parse_mode='Markdown')
 
-def send_scheduled_messages():
-    """Send messages to users based on their message frequency."""
-    session = get_db_session()
+async def send_scheduled_messages(context: ContextTypes.DEFAULT_TYPE):
+    """Send messages to users based on their message frequency.
+    
+    Runs as a JobQueue job at each of the SCHEDULED_HOURS; the hour is passed
+    in as the job data and messages go out through the application's bot in
+    concurrent batches of SEND_BATCH_SIZE, one batch per second.
+    """
+    plans = REMINDER_PLANS.get(context.job.data)
+    if not plans:
+        return
+        
     try:
-        users = session.query(User).all()
-        current_hour = datetime.now().hour
+        async with get_async_session() as session:
+            # Plain column rows, no ORM instances; the IN filter uses the frequency index
+            rows = await session.stream(
+                select(User.telegram_id, User.message_frequency)
+                .where(User.message_frequency.in_(plans))
+                .execution_options(yield_per=500)
+            )
+            messages = [(telegram_id, plans[frequency]) async for telegram_id, frequency in rows]
+    except Exception:
+        logger.exception("Error loading scheduled message recipients")
+        return
 
-        for user in users:
-            if user.message_frequency == "once" and current_hour == 9:  # Example: 9 AM
-                bot.send_message(chat_id=user.telegram_id, text="Your daily Rust lesson is ready!")
-            elif user.message_frequency == "twice" and current_hour in [9, 17]:  # 9 AM and 5 PM
-                bot.send_message(chat_id=user.telegram_id, text="Your Rust lesson is ready!")
-            elif user.message_frequency == "three" and current_hour in [9, 13, 17]:  # 9 AM, 1 PM, 5 PM
-                bot.send_message(chat_id=user.telegram_id, text="Your Rust lesson is ready!")
-    except Exception as e:
-        print(f"Error sending scheduled messages: {e}")
-    finally:
-        session.close()
+    for offset in range(0, len(messages), SEND_BATCH_SIZE):
+        batch = messages[offset:offset + SEND_BATCH_SIZE]
+        results = await asyncio.gather(
+            *(context.bot.send_message(chat_id=chat_id, text=text) for chat_id, text in batch),
+            return_exceptions=True
+        )
+        for (chat_id, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to send scheduled message to %s: %s", chat_id, result)
+        if offset + SEND_BATCH_SIZE < len(messages):
+            await asyncio.sleep(1)  # Stay under Telegram's ~30 messages/second limit
 
-# Schedule the task
-schedule.every().hour.at(":00").do(send_scheduled_messages)
+def build_application() -> Application:
+    """Build the bot application with its handlers and scheduled jobs.
+    
+    This is the single place the bot is wired together; every runtime
+    setting (concurrency, handlers, reminder schedule) is configured here.
+    
+    Returns:
+        telegram.ext.Application: The configured, not yet initialized application
+    """
+    # Updates are handled concurrently, so handlers must only share state that
+    # is safe across tasks (e.g. the async OpenAI client)
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(MAX_CONCURRENT_UPDATES)
+        .build()
+    )
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("progress", check_progress))
+    application.add_handler(CommandHandler("mini", mini_lesson))
+    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-def run_scheduler():
-    """Run the scheduler in a loop."""
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    # Schedule lesson reminders on the application's own event loop
+    for hour in SCHEDULED_HOURS:
+        application.job_queue.run_daily(
+            send_scheduled_messages,
+            time=time(hour, 0, tzinfo=SCHEDULE_TIMEZONE),
+            data=hour,
+            name=f"scheduled_messages_{hour}"
+        )
+    return application
 
 async def main():
     """Start the bot."""
     try:
         # Initialize database
         init_db()
+        await warm_async_pool()
         
-        # Create the Application
-        application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-        
-        # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("progress", check_progress))
-        application.add_handler(CommandHandler("mini", mini_lesson))
-        application.add_handler(CallbackQueryHandler(handle_callback))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        application = build_application()
 
         # ✅ Manually start bot without closing the event loop
         await application.initialize()
         await application.start()
-        await application.updater.start_polling()
+        await application.updater.start_polling(
+            timeout=30,  # Park each getUpdates call on Telegram's side for up to 30s
+            poll_interval=0.0,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
 
         logger.info("Bot is running...")
+        logger.info("Database pools: %s", pool_status())
 
         # Keep bot running without interfering with Railway’s event loop
-        await asyncio.Event().wait()  # Keeps the event loop alive
+        try:
+            await asyncio.Event().wait()  # Keeps the event loop alive
+        finally:
+            # Stop the single polling worker before the loop closes
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+            await async_engine.dispose()
 
-    except Exception as e:
+    except Exception:
         logger.exception("Unhandled exception in main bot loop")
 
 if __name__ == '__main__':
-    import threading
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
     try:
-        asyncio.run(main())  # Runs without messing with the event loop
+        # Runs without messing with the event loop; uvloop's when it is installed
+        (uvloop.run if uvloop else asyncio.run)(main())
     except RuntimeError as e:
-        logger.error(f"Runtime error: {e}")
+        logger.error("Runtime error: %s", e)
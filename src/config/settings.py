@@ -1,6 +1,11 @@
+import atexit
 import os
 from dotenv import load_dotenv
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+from zoneinfo import ZoneInfo
+from tzlocal import get_localzone
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +27,18 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///rust_learning.db')
 DEFAULT_MESSAGE_FREQUENCY = "once"  # once, twice, or three times per day
 MINIMUM_TIME_BETWEEN_MESSAGES = 4  # hours
 MAX_MESSAGES_PER_DAY = 3
+# Zone the reminder hours are in (e.g. 'Europe/Berlin'); defaults to the server's zone.
+# A named zone rather than a fixed offset, so reminders follow DST changes
+SCHEDULE_TIMEZONE = ZoneInfo(os.environ['BOT_TIMEZONE']) if os.getenv('BOT_TIMEZONE') else get_localzone()
+
+# OpenAI settings
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))  # match your plan's RPM
+OPENAI_MAX_RETRIES = 6  # retries with exponential backoff on 429s and transient errors
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', '16'))  # async requests in flight at once
+# Interactive replies use the fast model; mini-lessons, where quality shows most, the stronger one.
+# Both must support JSON output, and the fast one structured outputs
+OPENAI_FAST_MODEL = os.getenv('OPENAI_FAST_MODEL', 'gpt-4o-mini')
+OPENAI_QUALITY_MODEL = os.getenv('OPENAI_QUALITY_MODEL', 'gpt-4-turbo')
 
 # Logging Configuration
 def setup_logging():
@@ -33,14 +50,21 @@ def setup_logging():
     - Message format
     - Default log level set to INFO
     - Suppressed httpx logging to reduce noise
+    - Records handed to a background thread through a queue, so writing to
+      stdout never blocks the event loop
     
     Returns:
         logging.Logger: The configured logger instance
     """
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
-    )
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue = Queue(-1)
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))  # The stream handler adds the prefix
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    listener.start()
+    atexit.register(listener.stop)  # Flush queued records on exit
     # Silence httpx logging
     logging.getLogger("httpx").setLevel(logging.WARNING)
     return logging.getLogger(__name__) 
\ No newline at end of file
@@ -1,9 +1,11 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+import asyncio
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 import os
 from dotenv import load_dotenv
-from src.database.models import Base
 from src.database.migrations import run_migrations
 
 # Load environment variables
@@ -16,29 +18,130 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///rust_learning.db')
 if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Handlers talk to the same database through asyncio drivers
+if DATABASE_URL.startswith('sqlite://'):
+    ASYNC_DATABASE_URL = DATABASE_URL.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+elif DATABASE_URL.startswith('postgresql://'):
+    ASYNC_DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
+else:
+    ASYNC_DATABASE_URL = DATABASE_URL
+
+# Pool sizing for the async engine the handlers use; tune per deployment
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '40'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds before a connection is replaced
+
+# SQLite connections are handed between threads by the pool
+connect_args = {"check_same_thread": False, "timeout": 30} if DATABASE_URL.startswith('sqlite') else {}
+
+# Build the engine once at import so every session reuses pooled connections
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=QueuePool,
+    pool_size=5,
+    max_overflow=10,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_use_lifo=True,  # Reuse the most recently returned connection so idle ones can age out
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    query_cache_size=1200,
+    connect_args=connect_args
+)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_use_lifo=True,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
+    query_cache_size=1200,  # Room for every distinct statement the bot issues
+    connect_args=connect_args
+)
+
+if engine.dialect.name == 'sqlite':
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        """Enable WAL so readers don't block the writer and relax fsync per commit."""
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-20000")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
+
+SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, expire_on_commit=False))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 def init_db():
     """Initialize the database connection and create all necessary tables.
     
-    This function creates a new database engine using the configured DATABASE_URL,
+    This function reuses the module-level engine built from the configured DATABASE_URL,
     creates all tables defined in the SQLAlchemy models if they don't exist,
     and returns the engine instance for further use.
     
     Returns:
         sqlalchemy.engine.Engine: The configured database engine instance
     """
-    Base.metadata.create_all(engine)
-    run_migrations()  # Run migrations to add new columns
+    run_migrations(engine)  # Creates missing tables, then adds new columns
     return engine
 
+async def warm_async_pool():
+    """Open the async pool's connections before the first update arrives.
+    
+    Connections are otherwise created lazily, so the first users after a
+    restart would each pay the connect (and for Postgres, TLS and auth) cost.
+    """
+    async def probe():
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    
+    await asyncio.gather(*(probe() for _ in range(async_engine.pool.size())))
+
+def pool_status() -> dict:
+    """Report how many connections each pool holds, for logging and debugging.
+    
+    Returns:
+        dict: Idle and checked-out connection counts for the async and sync pools
+    """
+    return {
+        name: {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow()
+        }
+        for name, pool in (("async", async_engine.pool), ("sync", engine.pool))
+    }
+
 def get_db_session():
-    """Get a database session."""
-    db = SessionLocal()
+    """Get a database session bound to the shared, pooled engine."""
+    return SessionLocal()
+
+def get_async_session():
+    """Get an AsyncSession on the shared async engine; use it as `async with get_async_session() as session:`."""
+    return AsyncSessionLocal()
+
+@contextmanager
+def db_session():
+    """Provide a session that commits on success, rolls back on error and always closes.
+    
+    Closing hands the connection back to the pool as soon as the block ends.
+    
+    Yields:
+        sqlalchemy.orm.Session: The session for the current unit of work
+    """
+    session = SessionLocal()
     try:
-        return db  # Return the session directly instead of yielding
+        yield session
+        session.commit()
     except Exception:
-        db.close()
-        raise
\ No newline at end of file
+        session.rollback()
+        raise
+    finally:
+        session.close()
\ No newline at end of file
@@ -1,20 +1,31 @@
-from sqlalchemy import create_engine, text
-from src.config.settings import DATABASE_URL
+from sqlalchemy import text
 from src.database.models import Base
 
-def run_migrations():
-    """Run database migrations to update the schema."""
-    engine = create_engine(DATABASE_URL)
+# Bump this whenever a migration step is added below
+CURRENT_SCHEMA_VERSION = 6
+
+def run_migrations(engine):
+    """Run database migrations to update the schema.
+    
+    The applied revision is stored in SQLite's user_version, so once the
+    schema is current this returns without introspecting any tables.
     
+    Args:
+        engine (sqlalchemy.engine.Engine): The shared engine to migrate
+    """
     # Create all tables if they don't exist
     Base.metadata.create_all(engine)
     
-    with engine.connect() as connection:
+    with engine.begin() as connection:
+        schema_version = connection.execute(text("PRAGMA user_version;")).scalar()
+        if schema_version >= CURRENT_SCHEMA_VERSION:
+            return
+        
         # Check and add last_active column if it doesn't exist
         result = connection.execute(text("""
             PRAGMA table_info(users);
         """))
-        columns = [row[1] for row in result.fetchall()]
+        columns = {row[1] for row in result}
         
         if 'last_active' not in columns:
             connection.execute(text("""
@@ -28,7 +39,90 @@ def run_migrations():
                 ADD COLUMN message_frequency VARCHAR(10) DEFAULT 'once';
             """))
         
-        connection.commit()
+        # Index the column the scheduled reminder job filters on
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_users_message_frequency
+            ON users (message_frequency);
+        """))
+        
+        # Enum columns used to store member names ('ADVANCED'); they now hold the values
+        connection.execute(text("""
+            UPDATE topics SET difficulty_level = lower(difficulty_level);
+        """))
+        connection.execute(text("""
+            UPDATE user_achievements SET achievement_type = lower(achievement_type);
+        """))
+        
+        # Merge duplicate topics and progress rows so the upsert keys can be unique.
+        # Progress first moves to the surviving (lowest id) topic of each title...
+        connection.execute(text("""
+            UPDATE user_progress SET topic_id = (
+                SELECT MIN(duplicate.id) FROM topics original
+                JOIN topics duplicate ON duplicate.title = original.title
+                WHERE original.id = user_progress.topic_id
+            )
+            WHERE topic_id IN (SELECT id FROM topics);
+        """))
+        connection.execute(text("""
+            DELETE FROM topics WHERE id NOT IN (SELECT MIN(id) FROM topics GROUP BY title);
+        """))
+        # ...then each user's duplicate rows for a topic are folded into the kept one,
+        # so no mastery or practice count is lost when the others are deleted
+        connection.execute(text("""
+            UPDATE user_progress SET
+                mastery_level = (
+                    SELECT MAX(duplicate.mastery_level) FROM user_progress duplicate
+                    WHERE duplicate.user_id = user_progress.user_id
+                    AND duplicate.topic_id = user_progress.topic_id
+                ),
+                times_practiced = (
+                    SELECT SUM(duplicate.times_practiced) FROM user_progress duplicate
+                    WHERE duplicate.user_id = user_progress.user_id
+                    AND duplicate.topic_id = user_progress.topic_id
+                ),
+                last_practiced = (
+                    SELECT MAX(duplicate.last_practiced) FROM user_progress duplicate
+                    WHERE duplicate.user_id = user_progress.user_id
+                    AND duplicate.topic_id = user_progress.topic_id
+                )
+            WHERE id IN (
+                SELECT MIN(id) FROM user_progress GROUP BY user_id, topic_id HAVING COUNT(*) > 1
+            );
+        """))
+        connection.execute(text("""
+            DELETE FROM user_progress WHERE id NOT IN (
+                SELECT MIN(id) FROM user_progress GROUP BY user_id, topic_id
+            );
+        """))
+        connection.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_topics_title ON topics (title);
+        """))
+        connection.execute(text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ix_user_progress_user_topic
+            ON user_progress (user_id, topic_id);
+        """))
+        
+        # Per-user lookups on the remaining child tables (resets, progress reports)
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_learning_sessions_user_id ON learning_sessions (user_id);
+        """))
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_user_achievements_user_id ON user_achievements (user_id);
+        """))
+        
+        # Older tables were created without a column default for achieved_at,
+        # which SQLite can't add in place; stamp new rows from a trigger instead
+        connection.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS user_achievements_achieved_at
+            AFTER INSERT ON user_achievements
+            WHEN NEW.achieved_at IS NULL
+            BEGIN
+                UPDATE user_achievements SET achieved_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END;
+        """))
+        
+        connection.execute(text(f"PRAGMA user_version = {CURRENT_SCHEMA_VERSION};"))
 
 if __name__ == "__main__":
-    run_migrations() 
\ No newline at end of file
+    from src.database.connection import engine
+    run_migrations(engine) 
\ No newline at end of file
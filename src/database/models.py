@@ -1,6 +1,6 @@
 from datetime import datetime
 import enum
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Boolean, JSON, Enum
+from sqlalchemy import func, create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Boolean, JSON, CheckConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
@@ -21,14 +21,20 @@ class AchievementType(enum.Enum):
     CODE_WARRIOR = "code_warrior"
     RUST_EXPERT = "rust_expert"
 
+def _one_of(column, enum_cls):
+    """Build a CHECK constraint limiting a plain string column to an enum's values."""
+    values = ", ".join(f"'{member.value}'" for member in enum_cls)
+    return CheckConstraint(f"{column} IN ({values})", name=f"ck_{column}")
+
 class Topic(Base):
     __tablename__ = 'topics'
+    __table_args__ = (_one_of('difficulty_level', DifficultyLevel),)
     
     id = Column(Integer, primary_key=True)
-    title = Column(String, nullable=False)
+    title = Column(String, nullable=False, unique=True, index=True)
     description = Column(String)
     content = Column(String, nullable=False)
-    difficulty_level = Column(Enum(DifficultyLevel), nullable=False)
+    difficulty_level = Column(String(12), nullable=False, default=DifficultyLevel.BEGINNER.value)
     prerequisites = Column(JSON, default=[])
     code_examples = Column(JSON)
     practice_exercises = Column(JSON)
@@ -40,17 +46,18 @@ class Topic(Base):
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (_one_of('current_level', DifficultyLevel),)
     
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(String, unique=True, nullable=False)
+    telegram_id = Column(String, unique=True, index=True, nullable=False)
     username = Column(String)
-    current_level = Column(String, default='beginner')
+    current_level = Column(String(12), default=DifficultyLevel.BEGINNER.value)
     preferences = Column(JSON, default={})
     streak_count = Column(Integer, default=0)
     last_interaction = Column(DateTime, default=datetime.utcnow)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_active = Column(DateTime, default=datetime.utcnow)
-    message_frequency = Column(String(10), default='once')
+    message_frequency = Column(String(10), default='once', index=True)
     
     # Relationships
     progress = relationship("UserProgress", back_populates="user")
@@ -59,13 +66,14 @@ class User(Base):
 
 class UserProgress(Base):
     __tablename__ = 'user_progress'
+    __table_args__ = (Index('ix_user_progress_user_topic', 'user_id', 'topic_id', unique=True),)
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     topic_id = Column(Integer, ForeignKey('topics.id'))
     mastery_level = Column(Float, default=0.0)
     times_practiced = Column(Integer, default=0)
-    last_practiced = Column(DateTime)
+    last_practiced = Column(DateTime, server_default=func.now(), onupdate=func.now())
     next_review = Column(DateTime)
     is_bookmarked = Column(Boolean, default=False)
     
@@ -77,7 +85,7 @@ class LearningSession(Base):
     __tablename__ = 'learning_sessions'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime)
     topics_covered = Column(JSON)
@@ -88,11 +96,12 @@ class LearningSession(Base):
 
 class UserAchievement(Base):
     __tablename__ = 'user_achievements'
+    __table_args__ = (_one_of('achievement_type', AchievementType),)
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
-    achievement_type = Column(Enum(AchievementType), nullable=False)
-    achieved_at = Column(DateTime, default=datetime.utcnow)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    achievement_type = Column(String(20), nullable=False)
+    achieved_at = Column(DateTime, server_default=func.now(), nullable=False)  # Filled in by the INSERT
     details = Column(JSON)
     
     # Relationships
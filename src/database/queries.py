@@ -0,0 +1,41 @@
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.database.connection import async_engine
+from src.database.models import Topic, User, UserAchievement, UserProgress
+
+# The hot lookups are built as lambda statements: SQLAlchemy caches the
+# construct on first use, so later calls only bind the new parameter values
+
+def user_id_by_telegram_id(telegram_id: str):
+    """Select the users.id for a Telegram ID."""
+    return lambda_stmt(lambda: select(User.id).where(User.telegram_id == telegram_id))
+
+def topic_id_by_title(title: str):
+    """Select the topics.id for a topic title."""
+    return lambda_stmt(lambda: select(Topic.id).where(Topic.title == title))
+
+def topic_title_by_id(topic_id: int):
+    """Select a topic's title by its primary key."""
+    return lambda_stmt(lambda: select(Topic.title).where(Topic.id == topic_id))
+
+def user_profile_by_telegram_id(telegram_id: str):
+    """Select the profile columns CachedUser holds for a Telegram ID."""
+    return lambda_stmt(lambda: select(
+        User.id, User.current_level, User.streak_count, User.message_frequency
+    ).where(User.telegram_id == telegram_id))
+
+def progress_rows_for_user(user_id: int):
+    """Select a user's mastery, practice count and topic title per progress row."""
+    return lambda_stmt(lambda: select(
+        UserProgress.mastery_level, UserProgress.times_practiced, Topic.title
+    ).join(Topic, UserProgress.topic_id == Topic.id).where(UserProgress.user_id == user_id))
+
+def achievement_types_for_user(user_id: int):
+    """Select the stored type of each achievement a user holds."""
+    return lambda_stmt(lambda: select(UserAchievement.achievement_type).where(UserAchievement.user_id == user_id))
+
+def insert_ignore(model, **values):
+    """Build an INSERT ... ON CONFLICT DO NOTHING for the configured database."""
+    insert = pg_insert if async_engine.dialect.name == 'postgresql' else sqlite_insert
+    return insert(model).values(**values).on_conflict_do_nothing()
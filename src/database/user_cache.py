@@ -0,0 +1,68 @@
+from threading import Lock
+from typing import NamedTuple, Optional
+from cachetools import LRUCache, TTLCache
+from sqlalchemy.orm import Session
+from src.database.queries import user_profile_by_telegram_id
+
+class CachedUser(NamedTuple):
+    """The slice of a user's profile that read paths need."""
+    id: int
+    current_level: str
+    streak_count: int
+    message_frequency: str
+
+# Profiles change rarely, so keep them for a few minutes keyed by Telegram ID
+USER_CACHE = TTLCache(maxsize=10_000, ttl=300)
+_cache_lock = Lock()
+
+# Progress reports are rebuilt from several queries; keep each briefly so repeated
+# /progress presses reuse it. Writers to a user's progress call invalidate_progress
+PROGRESS_CACHE = TTLCache(maxsize=10_000, ttl=60)
+
+# Users are never deleted, so their row ids can be kept until evicted; only
+# touched from the event loop, so no lock is needed
+USER_IDS = LRUCache(maxsize=10_000)
+
+def get_cached_user(session: Session, telegram_id: str) -> Optional[CachedUser]:
+    """Return a user's profile, loading it from the database on a cache miss.
+    
+    Args:
+        session (Session): The session to query with on a cache miss
+        telegram_id (str): The Telegram ID of the user
+        
+    Returns:
+        Optional[CachedUser]: The cached profile, or None if the user doesn't exist
+    """
+    with _cache_lock:
+        user = USER_CACHE.get(telegram_id)
+    if user is not None:
+        return user
+    
+    row = session.execute(user_profile_by_telegram_id(telegram_id)).first()
+    if row is None:
+        return None
+    
+    user = CachedUser(*row)
+    with _cache_lock:
+        USER_CACHE[telegram_id] = user
+    return user
+
+def get_cached_progress(telegram_id: str) -> Optional[dict]:
+    """Return a user's recent progress report, or None if it has to be rebuilt."""
+    with _cache_lock:
+        return PROGRESS_CACHE.get(telegram_id)
+
+def cache_progress(telegram_id: str, report: dict) -> None:
+    """Remember a freshly built progress report."""
+    with _cache_lock:
+        PROGRESS_CACHE[telegram_id] = report
+
+def invalidate_progress(telegram_id: str) -> None:
+    """Drop a user's cached progress report after their progress changed."""
+    with _cache_lock:
+        PROGRESS_CACHE.pop(telegram_id, None)
+
+def invalidate_user(telegram_id: str) -> None:
+    """Drop a user's cached profile after it has been written to."""
+    with _cache_lock:
+        USER_CACHE.pop(telegram_id, None)
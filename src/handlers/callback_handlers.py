@@ -1,107 +1,652 @@
+import asyncio
+import logging
+import re
+from types import MappingProxyType
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import ContextTypes
-from datetime import datetime
-from src.database.connection import get_db_session
-from src.database.models import User, Topic, UserProgress, LearningSession
-from src.utils.openai_tools import OpenAITools
+from cachetools import LRUCache
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.orm import raiseload, selectinload
+from src.database.connection import get_async_session
+from src.database.models import User, Topic, UserProgress, LearningSession, DifficultyLevel
+from src.database.queries import insert_ignore, topic_id_by_title, topic_title_by_id, user_id_by_telegram_id
+from src.database.user_cache import USER_IDS, invalidate_progress, invalidate_user
 from src.utils.achievement_manager import AchievementManager
+from src.utils.exceptions import OpenAIToolsError
 
-async def save_or_update_topic(user_id: str, title: str, content: str, difficulty_level: str):
-    """Save or update a topic and user progress"""
-    session = get_db_session()
-    try:
-        # Get or create user
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            user = User(telegram_id=user_id)
-            session.add(user)
-            session.flush()
-        
-        # Get or create topic
-        topic = session.query(Topic).filter_by(title=title).first()
-        if not topic:
-            topic = Topic(
-                title=title,
-                content=content,
-                difficulty_level=difficulty_level
-            )
-            session.add(topic)
-            session.flush()
-        
-        # Update user progress
-        progress = session.query(UserProgress).filter_by(
-            user_id=user.id,
-            topic_id=topic.id
-        ).first()
+logger = logging.getLogger(__name__)
+
+# Everything the achievement check walks, loaded up front; any other lazy load raises
+ACHIEVEMENT_LOAD_OPTIONS = (
+    selectinload(User.progress).selectinload(UserProgress.topic),
+    selectinload(User.achievements),
+    raiseload('*')
+)
+
+# The achievement rules hold no state, so one manager serves every update
+_ACHIEVEMENTS = AchievementManager()
+
+# Topics are never deleted, so their row ids can be cached for good (user ids live in user_cache)
+_TOPIC_IDS = LRUCache(maxsize=1024)
+
+# Keyboard parts that never change are built once; PTB's keyboard objects are immutable
+_PLAYGROUND_ROW = (InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/"),)
+_LESSON_DETAILS_BUTTON = InlineKeyboardButton("More Details ℹ️", callback_data="lesson_more_details")
+_LESSON_NEXT_BUTTON = InlineKeyboardButton("Next Lesson ➡️", callback_data="lesson_next")
+_LESSON_SETTINGS_ROW = (InlineKeyboardButton("⚙️ Settings", callback_data="settings"),)
+_NEXT_STEPS_MARKUP = InlineKeyboardMarkup((
+    (
+        _LESSON_NEXT_BUTTON,
+        InlineKeyboardButton("Practice More 🎯", callback_data="practice")
+    ),
+    _PLAYGROUND_ROW
+))
+
+# Menus with no per-user content
+_SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Restart Learning", callback_data="restart_learning"),
+        InlineKeyboardButton("⏰ Change Message Frequency", callback_data="change_frequency")
+    ],
+    [
+        InlineKeyboardButton("📝 Show Commands", callback_data="show_commands")
+    ],
+    [
+        InlineKeyboardButton("🔙 Back to Main Menu", callback_data="main_menu")
+    ]
+])
+_COMMANDS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")
+    ]
+])
+_RESTART_CONFIRM_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("✅ Yes, Reset Everything", callback_data="confirm_restart"),
+        InlineKeyboardButton("❌ No, Keep My Progress", callback_data="cancel_restart")
+    ]
+])
+_FREQUENCY_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Once per Day", callback_data="frequency_once"),
+        InlineKeyboardButton("Twice per Day", callback_data="frequency_twice")
+    ],
+    [
+        InlineKeyboardButton("Three Times per Day", callback_data="frequency_three")
+    ],
+    [
+        InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")
+    ]
+])
+_MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Start Today's Lesson", callback_data="lesson_start"),
+        InlineKeyboardButton("View Progress", callback_data="view_progress")
+    ],
+    [
+        InlineKeyboardButton("Practice Mode", callback_data="practice"),
+        InlineKeyboardButton("Settings", callback_data="settings")
+    ]
+])
+_PROGRESS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📚 Continue Learning", callback_data="lesson_start"),
+        InlineKeyboardButton("⚙️ Settings", callback_data="settings")
+    ]
+])
+_SOLUTION_MARKUP = InlineKeyboardMarkup([
+    _PLAYGROUND_ROW,
+    [
+        InlineKeyboardButton("Back to Practice 🎯", callback_data="lesson_practice")
+    ]
+])
+_NEXT_LESSON_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Practice 🎯", callback_data="lesson_practice"),
+        InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
+    ],
+    [
+        InlineKeyboardButton("Next Lesson ➡️", callback_data="next_lesson"),
+        InlineKeyboardButton("Back to Menu 🏠", callback_data="start")
+    ],
+    [
+        InlineKeyboardButton("⚙️ Settings", callback_data="settings")
+    ]
+])
+_FREQUENCY_TEXT = MappingProxyType({
+    "once": "once per day",
+    "twice": "twice per day",
+    "three": "three times per day"
+})
+
+# Map button actions to natural language for OpenAI
+_BUTTON_MEANINGS = MappingProxyType({
+    "lesson_start": "Generate a new mini-lesson based on my current progress and level.",
+    "view_progress": "Show me my learning progress and suggest what to focus on next.",
+    "practice": "Create a practice exercise that matches my current skill level.",
+    "settings": "Show available settings and configuration options.",
+    "lesson_more_details": "Provide more detailed explanation of the current topic with examples.",
+    "lesson_practice": "Generate a specific practice exercise for the current topic.",
+    "lesson_complete": "Mark the current topic as completed and update my progress.",
+    "lesson_next": "Move on to the next lesson based on my progress.",
+    "playground": "Open Rust Playground to practice coding",
+    "restart_learning": "Reset all learning progress and start fresh.",
+    "change_frequency": "Change how often I receive learning messages.",
+    "frequency_once": "Set message frequency to once per day.",
+    "frequency_twice": "Set message frequency to twice per day.",
+    "frequency_three": "Set message frequency to three times per day."
+})
+
+async def _get_or_insert_id(session, model, lookup, **values) -> int:
+    """Insert a row unless it already exists and return its primary key.
+    
+    The INSERT returns the new id directly; only when it hits the unique key
+    does this fall back to a SELECT for the existing row.
+    
+    Args:
+        session (AsyncSession): The session running the current transaction
+        model: The mapped class to insert into
+        lookup: A statement selecting the existing row's id
+        **values: Column values for the new row
         
-        if not progress:
-            progress = UserProgress(
-                user_id=user.id,
-                topic_id=topic.id,
+    Returns:
+        int: The id of the new or existing row
+    """
+    row_id = (await session.execute(
+        insert_ignore(model, **values).returning(model.id)
+    )).scalar()
+    if row_id is None:
+        row_id = (await session.execute(lookup)).scalar_one()
+    return row_id
+
+def _user_id_ref(telegram_id: str):
+    """Return the cached users.id for a Telegram id, or a subquery that resolves it."""
+    user_pk = USER_IDS.get(telegram_id)
+    if user_pk is None:
+        return select(User.id).where(User.telegram_id == telegram_id).scalar_subquery()
+    return user_pk
+
+async def save_or_update_topic(user_id: str, title: str, content: str, difficulty_level: str) -> Optional[int]:
+    """Save or update a topic and user progress.
+    
+    Each row is written with INSERT ... ON CONFLICT DO NOTHING, so a save is at
+    most three statements in one transaction, and just one once the user and
+    topic ids are cached.
+    
+    Returns:
+        Optional[int]: The topic's id, or None if the save failed
+    """
+    try:
+        async with get_async_session() as session, session.begin():
+            user_pk = USER_IDS.get(user_id)
+            if user_pk is None:
+                user_pk = await _get_or_insert_id(
+                    session, User, user_id_by_telegram_id(user_id), telegram_id=user_id
+                )
+            topic_pk = _TOPIC_IDS.get(title)
+            if topic_pk is None:
+                topic_pk = await _get_or_insert_id(
+                    session, Topic, topic_id_by_title(title),
+                    title=title, content=content, difficulty_level=difficulty_level
+                )
+            await session.execute(insert_ignore(
+                UserProgress,
+                user_id=user_pk,
+                topic_id=topic_pk,
                 mastery_level=0.0,
                 times_practiced=0,
-                last_practiced=datetime.utcnow()
-            )
-            session.add(progress)
-        
-        session.commit()
-        return True
-    except Exception as e:
-        session.rollback()
-        print(f"Error saving progress: {str(e)}")
-        return False
-    finally:
-        session.close()
+                last_practiced=func.now()  # Tables created before the server default need it explicitly
+            ))
+        # Only remember ids once they are committed
+        USER_IDS[user_id] = user_pk
+        _TOPIC_IDS[title] = topic_pk
+        invalidate_progress(user_id)
+        return topic_pk
+    except Exception:
+        logger.exception("Error saving progress")
+        return None
+
+async def _topic_title(topic_id: int) -> Optional[str]:
+    """Look up a topic's title by the id carried in a button's callback_data."""
+    async with get_async_session() as session:
+        return (await session.execute(topic_title_by_id(topic_id))).scalar()
+
+async def _topic_pk(title: str) -> Optional[int]:
+    """Look up a topic's id by its title, from the cache when possible."""
+    topic_pk = _TOPIC_IDS.get(title)
+    if topic_pk is None:
+        async with get_async_session() as session:
+            topic_pk = (await session.execute(topic_id_by_title(title))).scalar()
+        if topic_pk is not None:
+            _TOPIC_IDS[title] = topic_pk
+    return topic_pk
+
+def _title_from_lesson_text(text: str) -> str:
+    """Recover the topic title from a lesson message's '🦀 *Title*' heading.
+    
+    Telegram strips the Markdown markers from message.text, so the '*' may be absent.
+    """
+    return text.split('\n')[0].replace('*', '').removeprefix('🦀').strip()
+
+def _title_from_exercise_text(text: str) -> str:
+    """Recover the topic title from an exercise message's 'Practice Exercise: Title' heading."""
+    return text.split('\n')[0].replace('*', '').partition('Practice Exercise:')[2].strip()
 
-async def update_user_progress(user_id: str, topic_title: str, mastery_increase: float = 0.1):
+async def update_user_progress(user_id: str, topic_id: int, mastery_increase: float = 0.1):
     """Update a user's progress for a specific topic.
     
     This function updates the user's mastery level for a given topic, increments
     the practice count, and updates the last practiced timestamp. The mastery
     level is capped at 1.0 (100%).
     
+    Topics already at full mastery are still written: every completion counts
+    toward times_practiced, which the practice-count achievements are based on.
+    
     Args:
         user_id (str): The Telegram ID of the user
-        topic_title (str): The title of the topic to update
+        topic_id (int): The id of the topic to update
         mastery_increase (float, optional): Amount to increase mastery by. Defaults to 0.1.
         
     Returns:
         bool: True if the update was successful, False otherwise
     """
-    session = get_db_session()
+    new_mastery = UserProgress.mastery_level + mastery_increase
+    # One statement resolves the user (unless their id is cached) and applies
+    # the update server-side; CASE is used for the clamp because SQLite has no LEAST()
+    stmt = (
+        update(UserProgress)
+        .where(
+            UserProgress.user_id == _user_id_ref(user_id),
+            UserProgress.topic_id == topic_id
+        )
+        # last_practiced is refreshed by the column's onupdate
+        .values(
+            mastery_level=case((new_mastery > 1.0, 1.0), else_=new_mastery),
+            times_practiced=UserProgress.times_practiced + 1
+        )
+        .returning(UserProgress.user_id)
+    )
     try:
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            return False
-            
-        topic = session.query(Topic).filter_by(title=topic_title).first()
-        if not topic:
-            return False
+        async with get_async_session() as session:
+            progress_user_id = (await session.execute(stmt)).scalar()
+            if progress_user_id is None:
+                return False
+            
+            # Check for achievements; the manager is synchronous, so run it on the sync session
+            new_achievements = await session.run_sync(
+                lambda sync_session: _ACHIEVEMENTS.check_and_award_achievements(
+                    sync_session,
+                    sync_session.get(User, progress_user_id, options=ACHIEVEMENT_LOAD_OPTIONS)
+                )
+            )
             
-        progress = session.query(UserProgress).filter_by(
-            user_id=user.id,
-            topic_id=topic.id
-        ).first()
+            await session.commit()
+        USER_IDS[user_id] = progress_user_id
+        invalidate_progress(user_id)
+        return True
+    except Exception:
+        logger.exception("Error updating progress")
+        return False
+
+async def _show_settings(query, user_id: str, payload: str, openai_tools):
+    """Show the settings menu."""
+    await query.message.reply_text(
+        "⚙️ *Settings*\n\n"
+        "Choose an option to configure your learning experience:",
+        parse_mode='Markdown',
+        reply_markup=_SETTINGS_MARKUP
+    )
+
+async def _show_commands(query, user_id: str, payload: str, openai_tools):
+    """List the bot's commands."""
+    commands_message = (
+        "📝 *Available Commands*\n\n"
+        "• /start - Start the bot and see the main menu\n"
+        "• /progress - View your learning progress and statistics\n"
+        "• /mini - Get a quick, personalized mini-lesson\n\n"
+        "💡 *Additional Features*\n"
+        "• Interactive buttons in messages for navigation\n"
+        "• Settings menu for customization\n"
+        "• Practice mode for hands-on learning\n"
+        "• Rust Playground integration\n\n"
+        "🔙 Use the back button to return to settings."
+    )
+    
+    await query.message.reply_text(
+        commands_message,
+        parse_mode='Markdown',
+        reply_markup=_COMMANDS_MARKUP
+    )
+
+async def _ask_restart(query, user_id: str, payload: str, openai_tools):
+    """Ask the user to confirm a progress reset."""
+    await query.message.reply_text(
+        "⚠️ *Reset Learning Progress*\n\n"
+        "Are you sure you want to reset all your learning progress? "
+        "This action cannot be undone.",
+        parse_mode='Markdown',
+        reply_markup=_RESTART_CONFIRM_MARKUP
+    )
+
+async def _confirm_restart(query, user_id: str, payload: str, openai_tools):
+    """Reset the user's progress after confirmation."""
+    success = await reset_user_progress(user_id)
+    if success:
+        await query.message.reply_text(
+            "✅ Your learning progress has been reset. "
+            "You can now start fresh with your Rust learning journey!"
+        )
+    else:
+        await query.message.reply_text(
+            "❌ Sorry, there was an error resetting your progress. "
+            "Please try again later."
+        )
+
+async def _show_frequency_options(query, user_id: str, payload: str, openai_tools):
+    """Show the message frequency options."""
+    await query.message.reply_text(
+        "⏰ *Message Frequency*\n\n"
+        "Choose how often you'd like to receive learning messages "
+        "(between 8:00 and 21:00):",
+        parse_mode='Markdown',
+        reply_markup=_FREQUENCY_MARKUP
+    )
+
+async def _set_frequency(query, user_id: str, payload: str, openai_tools):
+    """Save the chosen message frequency."""
+    frequency = query.data.split("_")[1]
+    success = await update_message_frequency(user_id, frequency)
+    if success:
+        frequency_text = _FREQUENCY_TEXT.get(frequency, "once per day")
         
-        if progress:
-            progress.mastery_level = min(1.0, progress.mastery_level + mastery_increase)
-            progress.times_practiced += 1
-            progress.last_practiced = datetime.utcnow()
-            
-            # Check for achievements
-            achievement_manager = AchievementManager(session)
-            new_achievements = achievement_manager.check_and_award_achievements(user)
-            
-            session.commit()
-            return True
-            
+        await query.message.reply_text(
+            f"✅ Your message frequency has been set to {frequency_text}."
+        )
+    else:
+        await query.message.reply_text(
+            "❌ Sorry, there was an error updating your message frequency. "
+            "Please try again later."
+        )
+
+async def _show_main_menu(query, user_id: str, payload: str, openai_tools):
+    """Show the main menu."""
+    await query.message.reply_text(
+        "🦀 *Welcome Back!*\n\n"
+        "What would you like to do?",
+        parse_mode='Markdown',
+        reply_markup=_MAIN_MENU_MARKUP
+    )
+
+async def _start_lesson(query, user_id: str, payload: str, openai_tools):
+    """Generate, show and save a new mini-lesson."""
+    # Send thinking message immediately
+    thinking_message = await query.message.reply_text(
+        "🤔 Generating a personalized lesson for you...\n"
+        "This might take a few moments."
+    )
+    
+    try:
+        lesson = await openai_tools.agenerate_mini_lesson(user_id)
+    except OpenAIToolsError as e:
+        await thinking_message.edit_text(f"❌ Sorry, I couldn't generate a lesson right now: {e}")
+        return
+    
+    # Save the lesson and create initial progress; the Practice button carries the topic's id
+    topic_pk = await save_or_update_topic(
+        user_id,
+        lesson.title,
+        lesson.content,
+        DifficultyLevel.BEGINNER.value  # You might want to determine this based on user's level
+    )
+    practice_data = f"lesson_practice:{topic_pk}" if topic_pk is not None else "lesson_practice"
+    complete_data = f"lesson_complete:{topic_pk}" if topic_pk is not None else "lesson_complete"
+    
+    # Create lesson navigation buttons with Playground; only Practice and Complete vary
+    reply_markup = InlineKeyboardMarkup((
+        (_LESSON_DETAILS_BUTTON, InlineKeyboardButton("Practice 🎯", callback_data=practice_data)),
+        _PLAYGROUND_ROW,
+        (
+            InlineKeyboardButton("Complete ✅", callback_data=complete_data),
+            _LESSON_NEXT_BUTTON
+        ),
+        _LESSON_SETTINGS_ROW
+    ))
+    
+    # Update the thinking message with the actual lesson
+    await thinking_message.edit_text(
+        f"🦀 *{lesson.title}*\n\n{lesson.content}\n\n💡 _Click 'Try in Playground' to practice this code in the Rust online editor!_",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def _show_progress(query, user_id: str, payload: str, openai_tools):
+    """Show progress statistics with an AI-generated analysis."""
+    try:
+        progress = await openai_tools.acheck_user_progress(user_id)
+    except Exception:
+        await query.message.reply_text("❌ Sorry, I couldn't find your progress data.")
+        return
+    # The analysis prompt is built from the same report, so hand it over rather than rebuild it
+    try:
+        analysis = await openai_tools.achat(user_id, _BUTTON_MEANINGS["view_progress"], progress=progress)
+    except Exception:
+        analysis = {"content": "Not available right now."}
+    
+    progress_message = (
+        "📊 *Your Progress*\n\n"
+        f"Level: {progress['user_level']}\n"
+        f"Topics: {progress['total_topics']} total\n"
+        f"Mastery: {progress['average_mastery']:.1%}\n"
+        f"Practice Sessions: {progress['total_practice_sessions']}\n"
+        f"Current Streak: {progress['streak_count']} days\n\n"
+        f"Analysis:\n{analysis['content']}"
+    )
+    
+    
+    # Replace the menu in place rather than leaving its buttons live above a new message
+    await query.edit_message_text(
+        progress_message, 
+        parse_mode='Markdown',
+        reply_markup=_PROGRESS_MARKUP
+    )
+
+async def _practice_lesson(query, user_id: str, payload: str, openai_tools):
+    """Generate a practice exercise for the lesson in the message."""
+    # Send thinking message immediately
+    thinking_message = await query.message.reply_text(
+        "🎯 Generating a practice exercise for you...\n"
+        "This might take a few moments."
+    )
+    
+    # Lesson buttons carry the topic's id; older messages and /mini lessons only have the text
+    topic_title = await _topic_title(int(payload)) if payload else None
+    if topic_title is None:
+        topic_title = _title_from_lesson_text(query.message.text)
+        topic_pk = await _topic_pk(topic_title)
+    else:
+        topic_pk = int(payload)
+    solution_data = f"show_solution:{topic_pk}" if topic_pk is not None else "show_solution"
+    
+    # Generate a practice exercise
+    try:
+        practice_exercise = await openai_tools.agenerate_practice_exercise(user_id, topic_title)
+    except OpenAIToolsError as e:
+        await thinking_message.edit_text(f"❌ Sorry, I couldn't generate a practice exercise right now: {e}")
+        return
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
+        ],
+        [
+            InlineKeyboardButton("Show Solution 🔍", callback_data=solution_data)
+        ],
+        [
+            InlineKeyboardButton("Back to Lesson 📚", callback_data="lesson_start")
+        ]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await thinking_message.edit_text(
+        f"🎯 *Practice Exercise: {topic_title}*\n\n"
+        f"{practice_exercise['description']}\n\n"
+        f"```rust\n{practice_exercise['code']}\n```\n\n"
+        "💡 _Try to solve this exercise! You can use the Rust Playground to test your solution._",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+async def _show_solution(query, user_id: str, payload: str, openai_tools):
+    """Show the solution for the exercise whose topic id is in the payload."""
+    topic_title = await _topic_title(int(payload)) if payload else None
+    if topic_title is None:
+        topic_title = _title_from_exercise_text(query.message.text)
+    try:
+        solution = await openai_tools.agenerate_solution(user_id, topic_title)
+    except OpenAIToolsError as e:
+        await query.message.reply_text(f"❌ Sorry, I couldn't generate the solution right now: {e}")
+        return
+    
+    
+    await query.message.reply_text(
+        f"🔍 *Solution for {topic_title}*\n\n"
+        f"{solution['explanation']}\n\n"
+        f"```rust\n{solution['code']}\n```\n\n"
+        "💡 _Try this solution in the Rust Playground to see how it works!_",
+        parse_mode='Markdown',
+        reply_markup=_SOLUTION_MARKUP
+    )
+
+async def _next_lesson(query, user_id: str, payload: str, openai_tools):
+    """Generate the lesson after the one in the message."""
+    # Send thinking message immediately
+    thinking_message = await query.message.reply_text(
+        "🤔 Generating the next lesson for you...\n"
+        "This might take a few moments."
+    )
+    
+    # Get the current topic from the message
+    topic_title = _title_from_lesson_text(query.message.text)
+    
+    # Generate the next lesson
+    try:
+        next_lesson = await openai_tools.achat(user_id, "next_lesson", topic_title)
+    except OpenAIToolsError as e:
+        await thinking_message.edit_text(f"❌ Sorry, I couldn't generate the next lesson right now: {e}")
+        return
+    
+    
+    await thinking_message.edit_text(
+        next_lesson['content'],
+        parse_mode='Markdown',
+        reply_markup=_NEXT_LESSON_MARKUP
+    )
+
+async def _answer_with_ai(query, user_id: str, payload: str, openai_tools, edit: bool = False):
+    """Reply to any other button with an OpenAI-generated response and its buttons.
+    
+    Args:
+        edit (bool): Replace the pressed message instead of sending a new one
+    """
+    # For all other buttons, use OpenAI to generate a contextual response
+    try:
+        response = await openai_tools.achat(user_id, _BUTTON_MEANINGS.get(query.data, query.data))
+    except OpenAIToolsError as e:
+        await query.message.reply_text(f"❌ Sorry, something went wrong: {e}")
+        return
+        
+    # Create keyboard from the buttons in the response
+    keyboard = []
+    for row in response['buttons']:
+        keyboard_row = []
+        for button in row:
+            if 'url' in button:
+                keyboard_row.append(InlineKeyboardButton(button['text'], url=button['url']))
+            else:
+                keyboard_row.append(InlineKeyboardButton(button['text'], callback_data=button['callback_data']))
+        keyboard.append(keyboard_row)
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    send = query.edit_message_text if edit else query.message.reply_text
+    await send(response['content'], parse_mode='Markdown', reply_markup=reply_markup)
+
+async def _show_more_details(query, user_id: str, payload: str, openai_tools):
+    """Expand the lesson in place, replacing its now-stale buttons."""
+    await _answer_with_ai(query, user_id, payload, openai_tools, edit=True)
+
+async def _complete_lesson(query, user_id: str, payload: str, openai_tools):
+    """Record progress for the completed topic and offer next steps below the lesson."""
+    # Lesson buttons carry the topic's id; older messages only have the text
+    if payload:
+        topic_pk = int(payload)
+    else:
+        topic_title = _title_from_lesson_text(query.message.text)
+        topic_pk = await _topic_pk(topic_title) if topic_title else None
+    if topic_pk is not None and await update_user_progress(user_id, topic_pk):
+        status = "✅ Progress saved! Great job completing this topic!"
+    else:
+        status = "❌ Sorry, I couldn't save your progress for this topic."
+    # Keep the lesson text but drop its buttons, which also stops Complete being pressed twice
+    await query.edit_message_reply_markup(reply_markup=None)
+    await query.message.reply_text(
+        f"{status}\n\nWhat would you like to do next?",
+        reply_markup=_NEXT_STEPS_MARKUP
+    )
+
+# Callback actions by the part of callback_data before the first ':'
+_CALLBACK_HANDLERS = {
+    "settings": _show_settings,
+    "show_commands": _show_commands,
+    "restart_learning": _ask_restart,
+    "confirm_restart": _confirm_restart,
+    "change_frequency": _show_frequency_options,
+    "frequency_once": _set_frequency,
+    "frequency_twice": _set_frequency,
+    "frequency_three": _set_frequency,
+    "main_menu": _show_main_menu,
+    "lesson_start": _start_lesson,
+    "view_progress": _show_progress,
+    "lesson_more_details": _show_more_details,
+    "lesson_practice": _practice_lesson,
+    "show_solution": _show_solution,
+    "next_lesson": _next_lesson,
+    "lesson_complete": _complete_lesson
+}
+
+# Everything our own keyboards can send; anything else is dropped before any I/O
+_VALID_ACTIONS = frozenset(_CALLBACK_HANDLERS.keys() | _BUTTON_MEANINGS.keys() | {"start", "cancel_restart"})
+# Payloads are topic ids, never titles: model-written titles can hold any character
+_TOPIC_ID_PATTERN = re.compile(r"[0-9]{1,10}")
+# Actions that carry a payload after the ':', and what it must look like
+_PAYLOAD_PATTERNS = MappingProxyType({
+    "lesson_complete": _TOPIC_ID_PATTERN,
+    "show_solution": _TOPIC_ID_PATTERN,
+    "lesson_practice": _TOPIC_ID_PATTERN
+})
+# Telegram limits callback_data to 64 bytes
+_MAX_CALLBACK_BYTES = 64
+# Shown for buttons this version of the bot no longer understands
+_STALE_BUTTON_NOTICE = "This button has expired. Send /mini for a fresh lesson."
+
+def _is_valid_callback(data: str) -> bool:
+    """Cheaply check callback_data against the buttons this bot actually sends.
+    
+    Args:
+        data (str): The callback_data from the pressed button
+        
+    Returns:
+        bool: True if the data names a known action with a well-formed payload
+    """
+    if not data or len(data.encode()) > _MAX_CALLBACK_BYTES:
         return False
-    except Exception as e:
-        session.rollback()
-        print(f"Error updating progress: {str(e)}")
+    action, separator, payload = data.partition(":")
+    if action not in _VALID_ACTIONS:
         return False
-    finally:
-        session.close()
+    if not separator:
+        return True
+    pattern = _PAYLOAD_PATTERNS.get(action)
+    return pattern is not None and pattern.fullmatch(payload) is not None
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries from inline keyboard buttons.
@@ -123,414 +668,26 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         None
     """
     query = update.callback_query
-    # Immediately acknowledge the callback query
-    await query.answer()
+    if not _is_valid_callback(query.data):
+        # Stale or forged button (e.g. one carrying a title from before payloads were
+        # topic ids): say so instead of leaving the press unanswered, and do nothing else
+        await query.answer(_STALE_BUTTON_NOTICE, show_alert=True)
+        return
     
-    # Show typing indicator
-    await update.effective_chat.send_chat_action("typing")
+    # Acknowledge the callback query and show the typing indicator in one round trip
+    await asyncio.gather(
+        query.answer(),
+        update.effective_chat.send_chat_action("typing")
+    )
     
-    openai_tools = OpenAITools()
+    from src.utils.openai_tools import get_openai_tools  # Deferred: pulls in openai/httpx
+    openai_tools = get_openai_tools()
     user_id = str(update.effective_user.id)
     
-    # Map button actions to natural language for OpenAI
-    button_meanings = {
-        "lesson_start": "Generate a new mini-lesson based on my current progress and level.",
-        "view_progress": "Show me my learning progress and suggest what to focus on next.",
-        "practice": "Create a practice exercise that matches my current skill level.",
-        "settings": "Show available settings and configuration options.",
-        "lesson_more_details": "Provide more detailed explanation of the current topic with examples.",
-        "lesson_practice": "Generate a specific practice exercise for the current topic.",
-        "lesson_complete": "Mark the current topic as completed and update my progress.",
-        "lesson_next": "Move on to the next lesson based on my progress.",
-        "playground": "Open Rust Playground to practice coding",
-        "restart_learning": "Reset all learning progress and start fresh.",
-        "change_frequency": "Change how often I receive learning messages.",
-        "frequency_once": "Set message frequency to once per day.",
-        "frequency_twice": "Set message frequency to twice per day.",
-        "frequency_three": "Set message frequency to three times per day."
-    }
-    
-    # Get the natural language meaning of the button
-    button_meaning = button_meanings.get(query.data, query.data)
-    
+    action, _, payload = query.data.partition(":")
+    handler = _CALLBACK_HANDLERS.get(action, _answer_with_ai)
     try:
-        if query.data == "settings":
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Restart Learning", callback_data="restart_learning"),
-                    InlineKeyboardButton("⏰ Change Message Frequency", callback_data="change_frequency")
-                ],
-                [
-                    InlineKeyboardButton("📝 Show Commands", callback_data="show_commands")
-                ],
-                [
-                    InlineKeyboardButton("🔙 Back to Main Menu", callback_data="main_menu")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                "⚙️ *Settings*\n\n"
-                "Choose an option to configure your learning experience:",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "show_commands":
-            commands_message = (
-                "📝 *Available Commands*\n\n"
-                "• /start - Start the bot and see the main menu\n"
-                "• /progress - View your learning progress and statistics\n"
-                "• /mini - Get a quick, personalized mini-lesson\n\n"
-                "💡 *Additional Features*\n"
-                "• Interactive buttons in messages for navigation\n"
-                "• Settings menu for customization\n"
-                "• Practice mode for hands-on learning\n"
-                "• Rust Playground integration\n\n"
-                "🔙 Use the back button to return to settings."
-            )
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                commands_message,
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "restart_learning":
-            keyboard = [
-                [
-                    InlineKeyboardButton("✅ Yes, Reset Everything", callback_data="confirm_restart"),
-                    InlineKeyboardButton("❌ No, Keep My Progress", callback_data="cancel_restart")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                "⚠️ *Reset Learning Progress*\n\n"
-                "Are you sure you want to reset all your learning progress? "
-                "This action cannot be undone.",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "confirm_restart":
-            success = await reset_user_progress(user_id)
-            if success:
-                await query.message.reply_text(
-                    "✅ Your learning progress has been reset. "
-                    "You can now start fresh with your Rust learning journey!"
-                )
-            else:
-                await query.message.reply_text(
-                    "❌ Sorry, there was an error resetting your progress. "
-                    "Please try again later."
-                )
-                
-        elif query.data == "change_frequency":
-            keyboard = [
-                [
-                    InlineKeyboardButton("Once per Day", callback_data="frequency_once"),
-                    InlineKeyboardButton("Twice per Day", callback_data="frequency_twice")
-                ],
-                [
-                    InlineKeyboardButton("Three Times per Day", callback_data="frequency_three")
-                ],
-                [
-                    InlineKeyboardButton("🔙 Back to Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                "⏰ *Message Frequency*\n\n"
-                "Choose how often you'd like to receive learning messages "
-                "(between 8:00 and 21:00):",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data.startswith("frequency_"):
-            frequency = query.data.split("_")[1]
-            success = await update_message_frequency(user_id, frequency)
-            if success:
-                frequency_text = {
-                    "once": "once per day",
-                    "twice": "twice per day",
-                    "three": "three times per day"
-                }.get(frequency, "once per day")
-                
-                await query.message.reply_text(
-                    f"✅ Your message frequency has been set to {frequency_text}."
-                )
-            else:
-                await query.message.reply_text(
-                    "❌ Sorry, there was an error updating your message frequency. "
-                    "Please try again later."
-                )
-                
-        elif query.data == "main_menu":
-            keyboard = [
-                [
-                    InlineKeyboardButton("Start Today's Lesson", callback_data="lesson_start"),
-                    InlineKeyboardButton("View Progress", callback_data="view_progress")
-                ],
-                [
-                    InlineKeyboardButton("Practice Mode", callback_data="practice"),
-                    InlineKeyboardButton("Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(
-                "🦀 *Welcome Back!*\n\n"
-                "What would you like to do?",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "lesson_start":
-            # Send thinking message immediately
-            thinking_message = await query.message.reply_text(
-                "🤔 Generating a personalized lesson for you...\n"
-                "This might take a few moments."
-            )
-            
-            lesson = openai_tools.generate_mini_lesson(user_id)
-            if "error" in lesson:
-                await thinking_message.edit_text(
-                    f"❌ Sorry, I couldn't generate a lesson right now: {lesson['error']}"
-                )
-                return
-            
-            # Save the lesson and create initial progress
-            await save_or_update_topic(
-                user_id,
-                lesson['title'],
-                lesson['content'],
-                'BEGINNER'  # You might want to determine this based on user's level
-            )
-            
-            # Create lesson navigation buttons with Playground
-            keyboard = [
-                [
-                    InlineKeyboardButton("More Details ℹ️", callback_data="lesson_more_details"),
-                    InlineKeyboardButton("Practice 🎯", callback_data="lesson_practice")
-                ],
-                [
-                    InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
-                ],
-                [
-                    InlineKeyboardButton("Complete ✅", callback_data=f"lesson_complete:{lesson['title']}"),
-                    InlineKeyboardButton("Next Lesson ➡️", callback_data="lesson_next")
-                ],
-                [
-                    InlineKeyboardButton("⚙️ Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Update the thinking message with the actual lesson
-            await thinking_message.edit_text(
-                f"🦀 *{lesson['title']}*\n\n{lesson['content']}\n\n💡 _Click 'Try in Playground' to practice this code in the Rust online editor!_",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "view_progress":
-            progress = openai_tools.check_user_progress(user_id)
-            if "error" in progress:
-                await query.message.reply_text("❌ Sorry, I couldn't find your progress data.")
-                return
-            
-            # Get AI-generated progress analysis
-            analysis = openai_tools.chat(user_id, button_meaning)
-            
-            progress_message = (
-                "📊 *Your Progress*\n\n"
-                f"Level: {progress['user_level']}\n"
-                f"Topics: {progress['total_topics']} total\n"
-                f"Mastery: {progress['average_mastery']:.1%}\n"
-                f"Practice Sessions: {progress['total_practice_sessions']}\n"
-                f"Current Streak: {progress['streak_count']} days\n\n"
-                f"Analysis:\n{analysis}"
-            )
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("📚 Continue Learning", callback_data="lesson_start"),
-                    InlineKeyboardButton("⚙️ Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.reply_text(
-                progress_message, 
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "lesson_practice":
-            # Send thinking message immediately
-            thinking_message = await query.message.reply_text(
-                "🎯 Generating a practice exercise for you...\n"
-                "This might take a few moments."
-            )
-            
-            # Get the current topic from the message
-            current_message = query.message.text
-            topic_title = current_message.split('\n')[0].replace('🦀 *', '').replace('*', '')
-            
-            # Generate a practice exercise
-            practice_exercise = openai_tools.generate_practice_exercise(user_id, topic_title)
-            
-            if "error" in practice_exercise:
-                await thinking_message.edit_text(
-                    f"❌ Sorry, I couldn't generate a practice exercise right now: {practice_exercise['error']}"
-                )
-                return
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
-                ],
-                [
-                    InlineKeyboardButton("Show Solution 🔍", callback_data=f"show_solution:{topic_title}")
-                ],
-                [
-                    InlineKeyboardButton("Back to Lesson 📚", callback_data="lesson_start")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await thinking_message.edit_text(
-                f"🎯 *Practice Exercise: {topic_title}*\n\n"
-                f"{practice_exercise['description']}\n\n"
-                f"```rust\n{practice_exercise['code']}\n```\n\n"
-                "💡 _Try to solve this exercise! You can use the Rust Playground to test your solution._",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data.startswith("show_solution:"):
-            topic_title = query.data.split(":", 1)[1]
-            solution = openai_tools.generate_solution(user_id, topic_title)
-            
-            if "error" in solution:
-                await query.message.reply_text(
-                    f"❌ Sorry, I couldn't generate the solution right now: {solution['error']}"
-                )
-                return
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
-                ],
-                [
-                    InlineKeyboardButton("Back to Practice 🎯", callback_data="lesson_practice")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.message.reply_text(
-                f"🔍 *Solution for {topic_title}*\n\n"
-                f"{solution['explanation']}\n\n"
-                f"```rust\n{solution['code']}\n```\n\n"
-                "💡 _Try this solution in the Rust Playground to see how it works!_",
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        elif query.data == "next_lesson":
-            # Send thinking message immediately
-            thinking_message = await query.message.reply_text(
-                "🤔 Generating the next lesson for you...\n"
-                "This might take a few moments."
-            )
-            
-            # Get the current topic from the message
-            current_message = query.message.text
-            topic_title = current_message.split('\n')[0].replace('🦀 *', '').replace('*', '')
-            
-            # Generate the next lesson
-            next_lesson = openai_tools.chat(user_id, "next_lesson", topic_title)
-            
-            if "error" in next_lesson:
-                await thinking_message.edit_text(
-                    f"❌ Sorry, I couldn't generate the next lesson right now: {next_lesson['error']}"
-                )
-                return
-            
-            # Create navigation keyboard
-            keyboard = [
-                [
-                    InlineKeyboardButton("Practice 🎯", callback_data="lesson_practice"),
-                    InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
-                ],
-                [
-                    InlineKeyboardButton("Next Lesson ➡️", callback_data="next_lesson"),
-                    InlineKeyboardButton("Back to Menu 🏠", callback_data="start")
-                ],
-                [
-                    InlineKeyboardButton("⚙️ Settings", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await thinking_message.edit_text(
-                next_lesson['content'],
-                parse_mode='Markdown',
-                reply_markup=reply_markup
-            )
-            
-        else:
-            # Handle lesson completion
-            if query.data.startswith("lesson_complete:"):
-                topic_title = query.data.split(":", 1)[1]
-                # Update progress for the completed topic
-                success = await update_user_progress(user_id, topic_title)
-                if success:
-                    await query.message.reply_text("✅ Progress saved! Great job completing this topic!")
-            
-            # For all other buttons, use OpenAI to generate a contextual response
-            response = openai_tools.chat(user_id, button_meaning)
-            
-            if "error" in response:
-                await query.message.reply_text(f"❌ Sorry, something went wrong: {response['error']}")
-                return
-                
-            # Create keyboard from the buttons in the response
-            keyboard = []
-            for row in response['buttons']:
-                keyboard_row = []
-                for button in row:
-                    if 'url' in button:
-                        keyboard_row.append(InlineKeyboardButton(button['text'], url=button['url']))
-                    else:
-                        keyboard_row.append(InlineKeyboardButton(button['text'], callback_data=button['callback_data']))
-                keyboard.append(keyboard_row)
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.message.reply_text(response['content'], parse_mode='Markdown', reply_markup=reply_markup)
-            
-            # If this was a lesson completion, show next steps
-            if query.data.startswith("lesson_complete:"):
-                keyboard = [
-                    [
-                        InlineKeyboardButton("Next Lesson ➡️", callback_data="lesson_next"),
-                        InlineKeyboardButton("Practice More 🎯", callback_data="practice")
-                    ],
-                    [
-                        InlineKeyboardButton("Try in Playground 💻", url="https://play.rust-lang.org/")
-                    ]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.message.reply_text(
-                    "What would you like to do next?",
-                    reply_markup=reply_markup
-                )
-    
+        await handler(query, user_id, payload, openai_tools)
     except Exception as e:
         await query.message.reply_text(f"❌ Sorry, something went wrong: {str(e)}")
 
@@ -546,25 +703,25 @@ async def reset_user_progress(user_id: str) -> bool:
     Returns:
         bool: True if the reset was successful, False otherwise
     """
-    session = get_db_session()
+    # The user is resolved inside each DELETE unless the id is cached, and no rows are loaded
+    user_pk = _user_id_ref(user_id)
     try:
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            return False
-            
-        # Delete all progress records
-        session.query(UserProgress).filter_by(user_id=user.id).delete()
-        # Delete all learning sessions
-        session.query(LearningSession).filter_by(user_id=user.id).delete()
-        
-        session.commit()
+        async with get_async_session() as session, session.begin():
+            # Delete all progress records
+            await session.execute(
+                delete(UserProgress).where(UserProgress.user_id == user_pk)
+                .execution_options(synchronize_session=False)
+            )
+            # Delete all learning sessions
+            await session.execute(
+                delete(LearningSession).where(LearningSession.user_id == user_pk)
+                .execution_options(synchronize_session=False)
+            )
+        invalidate_progress(user_id)
         return True
-    except Exception as e:
-        session.rollback()
-        print(f"Error resetting progress: {str(e)}")
+    except Exception:
+        logger.exception("Error resetting progress")
         return False
-    finally:
-        session.close()
 
 async def update_message_frequency(user_id: str, frequency: str) -> bool:
     """Update the user's preferred message frequency.
@@ -579,18 +736,16 @@ async def update_message_frequency(user_id: str, frequency: str) -> bool:
     Returns:
         bool: True if the update was successful, False otherwise
     """
-    session = get_db_session()
     try:
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user:
-            return False
-            
-        user.message_frequency = frequency
-        session.commit()
+        async with get_async_session() as session, session.begin():
+            result = await session.execute(
+                update(User).where(User.telegram_id == user_id).values(message_frequency=frequency)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                return False
+        invalidate_user(user_id)
         return True
-    except Exception as e:
-        session.rollback()
-        print(f"Error updating message frequency: {str(e)}")
-        return False
-    finally:
-        session.close() 
\ No newline at end of file
+    except Exception:
+        logger.exception("Error updating message frequency")
+        return False 
\ No newline at end of file
@@ -1,8 +1,44 @@
+import asyncio
+import html
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
-from src.database.connection import get_db_session
-from src.database.models import User
-from src.utils.openai_tools import OpenAITools
+from src.database.connection import get_async_session
+from src.database.models import User, DifficultyLevel
+from src.database.queries import insert_ignore
+from src.database.user_cache import USER_IDS
+from src.handlers.callback_handlers import save_or_update_topic
+
+# Replies that are the same for every user are built once
+_WELCOME_TEXT = (
+    "🦀 Welcome to the Rust Learning Bot! 🚀\n\n"
+    "I'm here to help you master Rust programming through:\n"
+    "• Daily lessons and exercises\n"
+    "• Interactive practice sessions\n"
+    "• Progress tracking\n"
+    "• Spaced repetition learning\n\n"
+    "Let's start your Rust journey! Choose an option below:"
+)
+_WELCOME_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Start Today's Lesson", callback_data="lesson_start"),
+        InlineKeyboardButton("View Progress", callback_data="view_progress")
+    ],
+    [
+        InlineKeyboardButton("Practice Mode", callback_data="practice"),
+        InlineKeyboardButton("Settings", callback_data="settings")
+    ]
+])
+_PROGRESS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📚 Continue Learning", callback_data="lesson_start"),
+        InlineKeyboardButton("⚙️ Settings", callback_data="settings")
+    ]
+])
+# Mini-lesson buttons that don't carry the lesson's topic id
+_MINI_DETAILS_BUTTON = InlineKeyboardButton("📚 More Details", callback_data="lesson_more_details")
+_MINI_NEXT_BUTTON = InlineKeyboardButton("⏭️ Next Topic", callback_data="lesson_next")
+_MINI_SETTINGS_ROW = (InlineKeyboardButton("⚙️ Settings", callback_data="settings"),)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /start command from users.
@@ -17,41 +53,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Returns:
         None
     """
-    db = get_db_session()
-    user = db.query(User).filter_by(telegram_id=str(update.effective_user.id)).first()
-    
-    if not user:
-        user = User(
-            telegram_id=str(update.effective_user.id),
-            username=update.effective_user.username
-        )
-        db.add(user)
-        db.commit()
-    
-    welcome_message = (
-        "🦀 Welcome to the Rust Learning Bot! 🚀\n\n"
-        "I'm here to help you master Rust programming through:\n"
-        "• Daily lessons and exercises\n"
-        "• Interactive practice sessions\n"
-        "• Progress tracking\n"
-        "• Spaced repetition learning\n\n"
-        "Let's start your Rust journey! Choose an option below:"
-    )
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("Start Today's Lesson", callback_data="lesson_start"),
-            InlineKeyboardButton("View Progress", callback_data="view_progress")
-        ],
-        [
-            InlineKeyboardButton("Practice Mode", callback_data="practice"),
-            InlineKeyboardButton("Settings", callback_data="settings")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
-    db.close()
+    telegram_id = str(update.effective_user.id)
+    # A cached id means the user is already registered; otherwise one statement
+    # registers them, and does nothing if they already exist
+    if telegram_id not in USER_IDS:
+        async with get_async_session() as session, session.begin():
+            await session.execute(insert_ignore(
+                User,
+                telegram_id=telegram_id,
+                username=update.effective_user.username
+            ))
+    
+    await update.message.reply_text(_WELCOME_TEXT, reply_markup=_WELCOME_MARKUP)
 
 async def check_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /progress command to show user's learning progress.
@@ -71,35 +84,33 @@ async def check_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Returns:
         None
     """
-    openai_tools = OpenAITools()
-    progress = openai_tools.check_user_progress(str(update.effective_user.id))
+    from src.utils.openai_tools import OpenAIToolsError, get_openai_tools  # Deferred: pulls in openai/httpx
+    openai_tools = get_openai_tools()
+    try:
+        progress = await openai_tools.acheck_user_progress(str(update.effective_user.id))
+    except OpenAIToolsError:
+        await update.message.reply_text("❌ Sorry, I couldn't find your progress data.")
+        return
     
     # Format the progress message
+    # HTML, since topic titles may contain characters (like _) that legacy Markdown rejects
     progress_message = (
-        f"📊 *Your Learning Progress*\n\n"
-        f"🎯 *Current Level:* {progress['user_level']}\n"
-        f"🔥 *Streak:* {progress['streak_count']} days\n\n"
-        f"📚 *Topics Mastered:*\n{bullet_list(progress['strong_topics'])}\n\n"
-        f"📖 *Topics in Progress:*\n{bullet_list(progress['weak_topics'])}\n\n"
-        f"🏆 *Achievements:*\n{bullet_list(progress['achievements'])}\n\n"
-        f"💪 *Practice Stats:*\n"
+        f"📊 <b>Your Learning Progress</b>\n\n"
+        f"🎯 <b>Current Level:</b> {progress['user_level']}\n"
+        f"🔥 <b>Streak:</b> {progress['streak_count']} days\n\n"
+        f"📚 <b>Topics Mastered:</b>\n{_escaped_bullet_list(progress['strong_topics'])}\n\n"
+        f"📖 <b>Topics in Progress:</b>\n{_escaped_bullet_list(progress['weak_topics'])}\n\n"
+        f"🏆 <b>Achievements:</b>\n{bullet_list(progress['achievements'])}\n\n"
+        f"💪 <b>Practice Stats:</b>\n"
         f"• Total Topics: {progress['total_topics']}\n"
         f"• Average Mastery: {progress['average_mastery']:.1%}\n"
         f"• Total Practice Sessions: {progress['total_practice_sessions']}"
     )
     
-    keyboard = [
-        [
-            InlineKeyboardButton("📚 Continue Learning", callback_data="lesson_start"),
-            InlineKeyboardButton("⚙️ Settings", callback_data="settings")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         progress_message,
-        parse_mode='Markdown',
-        reply_markup=reply_markup
+        parse_mode=ParseMode.HTML,
+        reply_markup=_PROGRESS_MARKUP
     )
 
 async def mini_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -120,42 +131,45 @@ async def mini_lesson(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Returns:
         None
     """
-    await update.message.reply_text("🤔 Generating a personalized mini-lesson for you...")
-    
-    openai_tools = OpenAITools()
-    lesson = openai_tools.generate_mini_lesson(str(update.effective_user.id))
+    # Send the notice while the lesson is generated rather than before it
+    intro = asyncio.create_task(
+        update.message.reply_text("🤔 Generating a personalized mini-lesson for you...")
+    )
     
-    if "error" in lesson:
-        await update.message.reply_text(
-            f"❌ Sorry, I couldn't generate a lesson right now: {lesson['error']}"
-        )
+    from src.utils.openai_tools import OpenAIToolsError, get_openai_tools
+    openai_tools = get_openai_tools()
+    try:
+        lesson = await openai_tools.agenerate_mini_lesson(str(update.effective_user.id))
+    except OpenAIToolsError as e:
+        await intro
+        await update.message.reply_text(f"❌ Sorry, I couldn't generate a lesson right now: {e}")
         return
+    await intro  # Keep the notice ahead of the lesson in the chat
+    
+    # Save the topic so Practice and Complete can refer to it by id
+    topic_pk = await save_or_update_topic(
+        str(update.effective_user.id),
+        lesson.title,
+        lesson.content,
+        DifficultyLevel.BEGINNER.value
+    )
+    suffix = f":{topic_pk}" if topic_pk is not None else ""
+    reply_markup = InlineKeyboardMarkup((
+        (_MINI_DETAILS_BUTTON, InlineKeyboardButton("💻 Practice Now", callback_data=f"lesson_practice{suffix}")),
+        (InlineKeyboardButton("✅ Mark as Complete", callback_data=f"lesson_complete{suffix}"), _MINI_NEXT_BUTTON),
+        _MINI_SETTINGS_ROW
+    ))
     
     # Send the main lesson content
     lesson_message = (
-        f"🦀 *{lesson['title']}*\n\n"
-        f"{lesson['content']}\n\n"
+        f"🦀 *{lesson.title}*\n\n"
+        f"{lesson.content}\n\n"
         "🔍 *Related Topics:*\n"
-        f"{bullet_list(lesson['related_topics'])}\n\n"
+        f"{bullet_list(lesson.related_topics)}\n\n"
         "💪 *Practice Suggestions:*\n"
-        f"{bullet_list(lesson['practice_suggestions'])}"
+        f"{bullet_list(lesson.practice_suggestions)}"
     )
     
-    keyboard = [
-        [
-            InlineKeyboardButton("📚 More Details", callback_data="lesson_more_details"),
-            InlineKeyboardButton("💻 Practice Now", callback_data="lesson_practice")
-        ],
-        [
-            InlineKeyboardButton("✅ Mark as Complete", callback_data="lesson_complete"),
-            InlineKeyboardButton("⏭️ Next Topic", callback_data="lesson_next")
-        ],
-        [
-            InlineKeyboardButton("⚙️ Settings", callback_data="settings")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await update.message.reply_text(
         lesson_message,
         reply_markup=reply_markup,
@@ -176,4 +190,8 @@ def bullet_list(items: list) -> str:
     """
     if not items:
         return "None yet"
-    return "\n".join(f"• {item}" for item in items) 
\ No newline at end of file
+    return "• " + "\n• ".join(map(str, items))
+
+def _escaped_bullet_list(items: list) -> str:
+    """Format a list of user-facing strings as an HTML-safe bullet list."""
+    return bullet_list([html.escape(item) for item in items])
@@ -1,62 +1,105 @@
-from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
-from src.database.models import User, UserAchievement, AchievementType
+from src.database.models import User, UserAchievement, AchievementType, DifficultyLevel
+
+# Streak thresholds in days, ascending, and the achievement each one earns
+_STREAK_TIERS = (
+    (3, AchievementType.STREAK_3_DAYS),
+    (7, AchievementType.STREAK_7_DAYS),
+    (30, AchievementType.STREAK_30_DAYS),
+)
+
+# Achievements decided by scanning the user's progress rows
+_PROGRESS_ACHIEVEMENTS = frozenset(
+    achievement_type.value for achievement_type in (
+        AchievementType.TOPIC_MASTERY,
+        AchievementType.PRACTICE_MASTER,
+        AchievementType.CODE_WARRIOR,
+        AchievementType.RUST_EXPERT,
+    )
+)
 
 class AchievementManager:
-    def __init__(self, db: Session):
-        self.db = db
+    """Stateless achievement rules; one instance is shared and given a session per call."""
+    
+    # Message templates, filled in from the achievement's details
+    MESSAGES = {
+        AchievementType.FIRST_LESSON: "🎉 First Lesson Completed! You've taken your first step in learning Rust!",
+        AchievementType.STREAK_3_DAYS: "🔥 3-Day Streak! You're building a great learning habit!",
+        AchievementType.STREAK_7_DAYS: "🌟 7-Day Streak! Your dedication is impressive!",
+        AchievementType.STREAK_30_DAYS: "🏆 30-Day Streak! You're a true Rust enthusiast!",
+        AchievementType.TOPIC_MASTERY: "🎯 Topic Mastery! You've mastered {topic}!",
+        AchievementType.PRACTICE_MASTER: "💪 Practice Master! You've completed 50 practice exercises!",
+        AchievementType.CODE_WARRIOR: "⚔️ Code Warrior! You've mastered 3 advanced topics!",
+        AchievementType.RUST_EXPERT: "👑 Rust Expert! You've achieved mastery across multiple topics!"
+    }
 
-    def check_and_award_achievements(self, user: User) -> list[UserAchievement]:
-        """Check user's progress and award any new achievements."""
-        new_achievements = []
+    def check_and_award_achievements(self, db: Session, user: User) -> list[UserAchievement]:
+        """Check user's progress and award any new achievements.
         
-        # Get existing achievements
-        existing_achievements = {
-            achievement.achievement_type 
-            for achievement in user.achievements
-        }
+        New achievements are added to the session in one batch; the caller
+        commits them together with the progress update that earned them.
         
-        # Check streak achievements
-        if user.streak_count >= 3 and AchievementType.STREAK_3_DAYS not in existing_achievements:
-            new_achievements.append(self._create_achievement(
-                user, 
-                AchievementType.STREAK_3_DAYS,
-                {"streak_count": user.streak_count}
-            ))
+        Args:
+            db (Session): The session the user was loaded with
+            user (User): The user, with progress, topics and achievements loaded
             
-        if user.streak_count >= 7 and AchievementType.STREAK_7_DAYS not in existing_achievements:
-            new_achievements.append(self._create_achievement(
-                user,
-                AchievementType.STREAK_7_DAYS,
-                {"streak_count": user.streak_count}
-            ))
-            
-        if user.streak_count >= 30 and AchievementType.STREAK_30_DAYS not in existing_achievements:
-            new_achievements.append(self._create_achievement(
-                user,
-                AchievementType.STREAK_30_DAYS,
-                {"streak_count": user.streak_count}
-            ))
+        Returns:
+            list[UserAchievement]: The achievements awarded by this call
+        """
+        new_achievements = []
         
-        # Check topic mastery achievements
-        for progress in user.progress:
-            if (progress.mastery_level >= 0.8 and 
-                AchievementType.TOPIC_MASTERY not in existing_achievements):
+        # Stored type values the user already holds, compared without building enums
+        earned = frozenset(achievement.achievement_type for achievement in user.achievements)
+        
+        # Check streak achievements, lowest threshold first
+        for threshold, achievement_type in _STREAK_TIERS:
+            if user.streak_count < threshold:
+                break
+            if achievement_type.value not in earned:
                 new_achievements.append(self._create_achievement(
                     user,
-                    AchievementType.TOPIC_MASTERY,
-                    {
-                        "topic": progress.topic.title,
-                        "mastery_level": progress.mastery_level
-                    }
+                    achievement_type,
+                    {"streak_count": user.streak_count}
                 ))
-                break
+        
+        # Users who hold every progress achievement don't need the scan below
+        if _PROGRESS_ACHIEVEMENTS <= earned:
+            db.add_all(new_achievements)
+            return new_achievements
+        
+        # Aggregate the progress in a single pass
+        total_practice_count = 0
+        mastery_sum = 0.0
+        advanced_topics_completed = 0
+        all_mastered = True
+        mastered_progress = None
+        for progress in user.progress:
+            total_practice_count += progress.times_practiced
+            mastery_sum += progress.mastery_level
+            if progress.mastery_level >= 0.8:
+                if mastered_progress is None:
+                    mastered_progress = progress
+            else:
+                all_mastered = False
+            if progress.topic.difficulty_level == DifficultyLevel.ADVANCED.value and progress.mastery_level >= 0.7:
+                advanced_topics_completed += 1
+        total_topics = len(user.progress)
+        
+        # Check topic mastery achievements
+        if mastered_progress is not None and AchievementType.TOPIC_MASTERY.value not in earned:
+            new_achievements.append(self._create_achievement(
+                user,
+                AchievementType.TOPIC_MASTERY,
+                {
+                    "topic": mastered_progress.topic.title,
+                    "mastery_level": mastered_progress.mastery_level
+                }
+            ))
         
         # Check practice achievements
-        total_practice_count = sum(p.times_practiced for p in user.progress)
         if (total_practice_count >= 50 and 
-            AchievementType.PRACTICE_MASTER not in existing_achievements):
+            AchievementType.PRACTICE_MASTER.value not in earned):
             new_achievements.append(self._create_achievement(
                 user,
                 AchievementType.PRACTICE_MASTER,
@@ -64,12 +107,8 @@ class AchievementManager:
             ))
         
         # Check code warrior achievement (completion of advanced topics)
-        advanced_topics_completed = sum(
-            1 for p in user.progress 
-            if p.topic.difficulty_level.value == "advanced" and p.mastery_level >= 0.7
-        )
         if (advanced_topics_completed >= 3 and 
-            AchievementType.CODE_WARRIOR not in existing_achievements):
+            AchievementType.CODE_WARRIOR.value not in earned):
             new_achievements.append(self._create_achievement(
                 user,
                 AchievementType.CODE_WARRIOR,
@@ -77,18 +116,19 @@ class AchievementManager:
             ))
         
         # Check Rust expert achievement (overall mastery)
-        if (len(user.progress) >= 10 and 
-            all(p.mastery_level >= 0.8 for p in user.progress) and
-            AchievementType.RUST_EXPERT not in existing_achievements):
+        if (total_topics >= 10 and 
+            all_mastered and
+            AchievementType.RUST_EXPERT.value not in earned):
             new_achievements.append(self._create_achievement(
                 user,
                 AchievementType.RUST_EXPERT,
                 {
-                    "total_topics": len(user.progress),
-                    "average_mastery": sum(p.mastery_level for p in user.progress) / len(user.progress)
+                    "total_topics": total_topics,
+                    "average_mastery": mastery_sum / total_topics
                 }
             ))
         
+        db.add_all(new_achievements)
         return new_achievements
 
     def _create_achievement(
@@ -97,27 +137,18 @@ class AchievementManager:
         achievement_type: AchievementType, 
         details: Dict[str, Any]
     ) -> UserAchievement:
-        """Create a new achievement record."""
+        """Build a new, not yet added, achievement record."""
         achievement = UserAchievement(
             user_id=user.id,
-            achievement_type=achievement_type,
-            achieved_at=datetime.utcnow(),
+            achievement_type=achievement_type.value,
             details=details
         )
-        self.db.add(achievement)
-        self.db.commit()
         return achievement
 
     def get_achievement_message(self, achievement: UserAchievement) -> str:
         """Generate a message for the achievement."""
-        messages = {
-            AchievementType.FIRST_LESSON: "🎉 First Lesson Completed! You've taken your first step in learning Rust!",
-            AchievementType.STREAK_3_DAYS: "🔥 3-Day Streak! You're building a great learning habit!",
-            AchievementType.STREAK_7_DAYS: "🌟 7-Day Streak! Your dedication is impressive!",
-            AchievementType.STREAK_30_DAYS: "🏆 30-Day Streak! You're a true Rust enthusiast!",
-            AchievementType.TOPIC_MASTERY: f"🎯 Topic Mastery! You've mastered {achievement.details['topic']}!",
-            AchievementType.PRACTICE_MASTER: "💪 Practice Master! You've completed 50 practice exercises!",
-            AchievementType.CODE_WARRIOR: "⚔️ Code Warrior! You've mastered 3 advanced topics!",
-            AchievementType.RUST_EXPERT: "👑 Rust Expert! You've achieved mastery across multiple topics!"
-        }
-        return messages.get(achievement.achievement_type, "🎉 New Achievement Unlocked!") 
\ No newline at end of file
+        achievement_type = AchievementType(achievement.achievement_type)
+        # Only the topic mastery message has a placeholder to fill in
+        if achievement_type is AchievementType.TOPIC_MASTERY:
+            return self.MESSAGES[achievement_type].format_map(achievement.details or {})
+        return self.MESSAGES.get(achievement_type, "🎉 New Achievement Unlocked!") 
\ No newline at end of file
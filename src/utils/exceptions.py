@@ -0,0 +1,5 @@
+class OpenAIToolsError(Exception):
+    """Raised when a reply, lesson, exercise or progress report can't be produced.
+    
+    Kept apart from openai_tools so handlers can catch it without importing the OpenAI SDK.
+    """
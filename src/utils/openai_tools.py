@@ -1,54 +1,146 @@
-from openai import OpenAI
-from typing import Dict, List, Optional
-from src.config.settings import OPENAI_API_KEY
-from src.database.connection import get_db_session
-from src.database.models import User, Topic, UserProgress, DifficultyLevel
+import asyncio
+import hashlib
+import httpx
+from cachetools import TTLCache
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from aiolimiter import AsyncLimiter
+from openai import AsyncOpenAI
+from openai.types.chat import ParsedChatCompletionMessage
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import Awaitable, Callable, Dict, List, Optional
+from src.config.settings import (
+    OPENAI_API_KEY,
+    OPENAI_CONCURRENCY,
+    OPENAI_FAST_MODEL,
+    OPENAI_MAX_RETRIES,
+    OPENAI_QUALITY_MODEL,
+    OPENAI_REQUESTS_PER_MINUTE
+)
+from src.database.connection import get_async_session
+from src.database.queries import achievement_types_for_user, progress_rows_for_user
+from src.database.user_cache import cache_progress, get_cached_progress, get_cached_user
+from src.utils.exceptions import OpenAIToolsError
 import json
+import re
+
+# The OpenAI client keeps warm connections to the API instead of reconnecting per request
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+# Fail fast on an unreachable API, but give completions time to generate
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Offered when the practice suggestions request fails
+_DEFAULT_PRACTICE_SUGGESTIONS = (
+    "Practice implementing the concepts shown in the example",
+    "Try modifying the code to handle different cases",
+    "Write tests for the implementation"
+)
+
+# Topics a lesson is checked for, in the order they are listed as related
+_COMMON_RUST_TOPICS = (
+    "ownership", "borrowing", "lifetimes", "traits", "generics",
+    "error handling", "concurrency", "pattern matching", "structs",
+    "enums", "modules", "testing", "cargo", "memory safety"
+)
+# One case-insensitive pass over the lesson instead of a substring scan per topic
+_RELATED_TOPICS_PATTERN = re.compile("|".join(map(re.escape, _COMMON_RUST_TOPICS)), re.IGNORECASE)
+
+# The chat system message never changes, so one dict is shared by every request
+_CHAT_SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful Rust programming tutor."}
+
+@dataclass(frozen=True, slots=True)
+class Lesson:
+    """A generated mini-lesson."""
+    title: str
+    content: str
+    difficulty: str
+    related_topics: List[str]
+    practice_suggestions: List[str]
+
+class ChatReply(BaseModel):
+    """The JSON schema chat replies are constrained to."""
+    content: str
+    code_example: Optional[str] = None
+    next_steps: Optional[str] = None
 
 class OpenAITools:
     def __init__(self):
-        """Initialize the OpenAI tools with API key and system prompt.
+        """Initialize the OpenAI tools with API key and request limits.
         
-        This constructor sets up the OpenAI client with the configured API key
-        and initializes a system prompt that defines the assistant's role as a
-        Rust programming expert.
+        This constructor sets up the async OpenAI client with the configured API key,
+        along with the rate limiter and generation cache its requests share.
         """
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.db = get_db_session()
-        self.system_prompt = """You are a helpful Rust programming assistant. You help users learn Rust by:
-1. Providing clear, concise explanations
-2. Showing practical code examples
-3. Answering follow-up questions
-4. Suggesting best practices
-5. Explaining error messages
-6. Recommending resources
-
-Keep responses focused on Rust programming. If asked about other topics, politely redirect to Rust-related discussions."""
-
-    def chat(self, user_id: str, message: str, current_topic: str = None) -> dict:
+        self.async_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            max_retries=OPENAI_MAX_RETRIES,
+            # HTTP/2 lets concurrent handler requests share one connection
+            http_client=httpx.AsyncClient(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+        )
+        # Admit async requests at the plan's rate instead of bouncing off 429s,
+        # and cap how many are in flight so a burst of updates can't pile onto the API
+        self.limiter = AsyncLimiter(max_rate=OPENAI_REQUESTS_PER_MINUTE, time_period=60)
+        self.request_slots = asyncio.Semaphore(OPENAI_CONCURRENCY)
+        # Exercises and solutions for the same topic and prompt are reused for an hour, and
+        # concurrent requests for one share a single call
+        self.generation_cache = TTLCache(maxsize=1024, ttl=3600)
+        self._pending_generations = {}  # Cache key -> Task for requests in flight
+
+    async def achat(
+        self,
+        user_id: str,
+        message: str,
+        current_topic: str = None,
+        progress: Optional[Dict] = None
+    ) -> dict:
         """Generate a response to user input using OpenAI's API.
         
         This method handles general chat interactions and generates contextual
-        responses based on the user's progress and current topic.
+        responses based on the user's progress and current topic. It is built on
+        `AsyncOpenAI`, so the bot keeps serving other updates while the request
+        is in flight.
         
         Args:
             user_id (str): The user's Telegram ID
             message (str): The user's message or button action
             current_topic (str, optional): The current topic being discussed
+            progress (Dict, optional): The user's progress report, if the caller already has it
             
         Returns:
-            dict: A dictionary containing the response content and any additional data
+            dict: A dictionary containing the response content and navigation buttons
+            
+        Raises:
+            OpenAIToolsError: If the user's progress or the response can't be fetched
         """
         try:
             # Get user's progress
-            progress = self.check_user_progress(user_id)
-            if "error" in progress:
-                return {"error": "Could not fetch user progress"}
+            if progress is None:
+                progress = await self.acheck_user_progress(user_id)
+            
+            async with self.request_slots, self.limiter:
+                response = await self.async_client.beta.chat.completions.parse(
+                    **self._chat_request(progress, message, current_topic)
+                )
             
-            # Create a prompt for the chat
-            prompt = f"""You are a helpful Rust programming tutor. The user's current level is {progress['user_level']} 
-and they have completed {progress['total_topics']} topics. Their strong topics are: {', '.join(progress['strong_topics'])} 
-and weak topics are: {', '.join(progress['weak_topics'])}. Their average mastery level is {progress['average_mastery']:.1%}.
+            return self._format_chat_response(response.choices[0].message)
+            
+        except OpenAIToolsError:
+            raise
+        except Exception as e:
+            raise OpenAIToolsError(str(e)) from e
+
+    def _chat_request(self, progress: Dict, message: str, current_topic: Optional[str]) -> Dict:
+        """Build the chat completion arguments for `achat`"""
+        summary = _progress_summary(
+            progress['user_level'],
+            progress['total_topics'],
+            tuple(progress['strong_topics']),
+            tuple(progress['weak_topics']),
+            progress['average_mastery']
+        )
+        
+        # Create a prompt for the chat
+        prompt = f"""{summary}
 
 User message: {message}
 
@@ -66,49 +158,49 @@ Format the response as JSON with these fields:
 - code_example: Optional code example (if relevant)
 - next_steps: Optional suggestions for what to learn next
 """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system", "content": "You are a helpful Rust programming tutor."},
-                    {"role": "user", "content": prompt}
+        return {
+            "model": OPENAI_FAST_MODEL,
+            "messages": [
+                _CHAT_SYSTEM_MESSAGE,
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": ChatReply
+        }
+
+    def _format_chat_response(self, message: ParsedChatCompletionMessage) -> Dict:
+        """Turn the parsed chat reply into message text and navigation buttons"""
+        result = message.parsed
+        if result is None:
+            raise OpenAIToolsError(message.refusal or "The response couldn't be parsed")
+        
+        # Format the response with code example if present
+        formatted_response = result.content
+        if result.code_example:
+            formatted_response += f"\n\n```rust\n{result.code_example}\n```"
+        if result.next_steps:
+            formatted_response += f"\n\n💡 *Next Steps:*\n{result.next_steps}"
+        
+        # Add navigation buttons
+        formatted_response += "\n\n_What would you like to do next?_"
+        
+        return {
+            'content': formatted_response,
+            'buttons': [
+                [
+                    {"text": "Next Lesson ➡️", "callback_data": "next_lesson"},
+                    {"text": "Practice 🎯", "callback_data": "lesson_practice"}
                 ],
-                response_format={"type": "json_object"}
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            
-            # Format the response with code example if present
-            formatted_response = result['content']
-            if result.get('code_example'):
-                formatted_response += f"\n\n```rust\n{result['code_example']}\n```"
-            if result.get('next_steps'):
-                formatted_response += f"\n\n💡 *Next Steps:*\n{result['next_steps']}"
-            
-            # Add navigation buttons
-            formatted_response += "\n\n_What would you like to do next?_"
-            
-            return {
-                'content': formatted_response,
-                'buttons': [
-                    [
-                        {"text": "Next Lesson ➡️", "callback_data": "next_lesson"},
-                        {"text": "Practice 🎯", "callback_data": "lesson_practice"}
-                    ],
-                    [
-                        {"text": "Try in Playground 💻", "url": "https://play.rust-lang.org/"}
-                    ],
-                    [
-                        {"text": "Back to Menu 🏠", "callback_data": "start"},
-                        {"text": "⚙️ Settings", "callback_data": "settings"}
-                    ]
+                [
+                    {"text": "Try in Playground 💻", "url": "https://play.rust-lang.org/"}
+                ],
+                [
+                    {"text": "Back to Menu 🏠", "callback_data": "start"},
+                    {"text": "⚙️ Settings", "callback_data": "settings"}
                 ]
-            }
-            
-        except Exception as e:
-            return {"error": str(e)}
+            ]
+        }
 
-    def check_user_progress(self, telegram_id: str) -> Dict:
+    async def acheck_user_progress(self, telegram_id: str) -> Dict:
         """Check user's learning progress and generate statistics.
         
         This function retrieves and analyzes the user's learning data to provide
@@ -118,43 +210,55 @@ Format the response as JSON with these fields:
         - Achievement status
         - Practice statistics
         
+        The report is built on an AsyncSession, so its queries go through the
+        async driver instead of tying up a worker thread.
+        
         Args:
             telegram_id (str): The Telegram ID of the user
             
         Returns:
             Dict: A dictionary containing progress statistics and recommendations
+            
+        Raises:
+            OpenAIToolsError: If the user has never started the bot
         """
-        user = self.db.query(User).filter_by(telegram_id=telegram_id).first()
+        report = get_cached_progress(telegram_id)
+        if report is not None:
+            return report
+        async with get_async_session() as session:
+            report = await session.run_sync(self._progress_report, telegram_id)
+        cache_progress(telegram_id, report)
+        return report
+
+    def _progress_report(self, session: Session, telegram_id: str) -> Dict:
+        """Build the progress statistics for `acheck_user_progress`"""
+        user = get_cached_user(session, telegram_id)
         if not user:
-            return {"error": "User not found"}
+            raise OpenAIToolsError("User not found")
         
-        # Get progress entries
-        progress_entries = self.db.query(UserProgress).filter_by(user_id=user.id).all()
+        # Get progress entries: only the columns the report uses, with titles joined in
+        # rather than loading each Topic (and its lesson content) one by one
+        progress_entries = session.execute(progress_rows_for_user(user.id)).all()
         
-        # Calculate statistics
+        # Calculate statistics and split strong from weak topics in a single pass
+        total_practice_sessions = 0
+        mastery_sum = 0.0
+        strong_topics = []
+        weak_topics = []
+        for mastery_level, times_practiced, title in progress_entries:
+            total_practice_sessions += times_practiced
+            mastery_sum += mastery_level
+            if mastery_level >= 0.7:
+                strong_topics.append(title)
+            else:
+                weak_topics.append(title)
         total_topics = len(progress_entries)
-        total_practice_sessions = sum(entry.times_practiced for entry in progress_entries)
-        average_mastery = (
-            sum(entry.mastery_level for entry in progress_entries) / total_topics 
-            if total_topics > 0 else 0
-        )
-        
-        # Get strong and weak topics
-        strong_topics = [
-            entry.topic.title 
-            for entry in progress_entries 
-            if entry.mastery_level >= 0.7
-        ]
-        weak_topics = [
-            entry.topic.title 
-            for entry in progress_entries 
-            if entry.mastery_level < 0.7
-        ]
+        average_mastery = mastery_sum / total_topics if total_topics > 0 else 0
         
         # Get achievements
         achievements = [
-            achievement.achievement_type.value.replace('_', ' ').title()
-            for achievement in user.achievements
+            achievement_type.replace('_', ' ').title()
+            for achievement_type, in session.execute(achievement_types_for_user(user.id))
         ]
         
         # Determine user level
@@ -176,7 +280,7 @@ Format the response as JSON with these fields:
             "total_practice_sessions": total_practice_sessions
         }
 
-    def generate_mini_lesson(self, telegram_id: str) -> Dict:
+    async def agenerate_mini_lesson(self, telegram_id: str) -> Lesson:
         """Generate a personalized mini Rust lesson.
         
         This function creates a customized lesson based on the user's current
@@ -187,84 +291,59 @@ Format the response as JSON with these fields:
         - Related topics for further learning
         - Practice suggestions
         
+        The lesson request goes through `AsyncOpenAI`, as does the separate
+        practice suggestions request when the lesson comes back without them.
+        
         Args:
             telegram_id (str): The Telegram ID of the user
             
         Returns:
-            Dict: A dictionary containing the lesson components or an error message
+            Lesson: The lesson components
+            
+        Raises:
+            OpenAIToolsError: If the user is unknown or the lesson can't be generated
         """
-        progress = self.check_user_progress(telegram_id)
-        
-        # Create a prompt based on user's progress
-        prompt = self._create_lesson_prompt(progress)
+        progress = await self.acheck_user_progress(telegram_id)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a Rust programming expert creating concise, engaging lessons."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            lesson_content = response.choices[0].message.content
+            async with self.request_slots, self.limiter:
+                response = await self.async_client.chat.completions.create(**self._lesson_request(progress))
             
-            # Structure the lesson
-            return {
-                "title": self._extract_title(lesson_content),
-                "content": lesson_content,
-                "difficulty": progress["user_level"],
-                "related_topics": self._get_related_topics(lesson_content),
-                "practice_suggestions": self._generate_practice_suggestions(lesson_content)
-            }
+            lesson = self._parse_lesson(response.choices[0].message.content, progress)
+            if not lesson.practice_suggestions:
+                lesson = replace(lesson, practice_suggestions=await self._agenerate_practice_suggestions(lesson.content))
+            return lesson
         except Exception as e:
-            return {"error": f"Failed to generate lesson: {str(e)}"}
+            raise OpenAIToolsError(f"Failed to generate lesson: {str(e)}") from e
 
-    def _get_weak_topics(self, progress_entries: List[UserProgress]) -> List[str]:
-        """Identify topics where the user's mastery level is below 60%.
-        
-        This helper function analyzes the user's progress entries and returns
-        a list of topic titles where the mastery level is below 0.6.
+    def _lesson_request(self, progress: Dict) -> Dict:
+        """Build the lesson completion arguments for `agenerate_mini_lesson`"""
+        return {
+            "model": OPENAI_QUALITY_MODEL,
+            "messages": [
+                {"role": "system", "content": "You are a Rust programming expert creating concise, engaging lessons."},
+                {"role": "user", "content": self._create_lesson_prompt(progress)}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.7,
+            "max_tokens": 1300  # Room for the practice suggestions next to the lesson
+        }
+
+    def _parse_lesson(self, raw_content: str, progress: Dict) -> Lesson:
+        """Turn the JSON lesson completion into a Lesson; its practice suggestions may be empty"""
+        result = json.loads(raw_content)
+        content = result['content']
+        suggestions = result.get('practice_suggestions')
+        if not isinstance(suggestions, list):
+            suggestions = []
         
-        Args:
-            progress_entries (List[UserProgress]): List of user progress records
-            
-        Returns:
-            List[str]: List of topic titles where mastery is below 60%
-        """
-        weak_topics = []
-        for entry in progress_entries:
-            if entry.mastery_level < 0.6:
-                topic = self.db.query(Topic).filter_by(id=entry.topic_id).first()
-                if topic:
-                    weak_topics.append(topic.title)
-        return weak_topics
-
-    def _get_strong_topics(self, progress_entries: List[UserProgress]) -> List[str]:
-        """Get topics where mastery level is above 0.8"""
-        strong_topics = []
-        for entry in progress_entries:
-            if entry.mastery_level >= 0.8:
-                topic = self.db.query(Topic).filter_by(id=entry.topic_id).first()
-                if topic:
-                    strong_topics.append(topic.title)
-        return strong_topics
-
-    def _get_recommended_topics(self, user: User, progress_entries: List[UserProgress]) -> List[str]:
-        """Get recommended next topics based on prerequisites and current progress"""
-        completed_topic_ids = {p.topic_id for p in progress_entries if p.mastery_level >= 0.7}
-        recommended = []
-        
-        all_topics = self.db.query(Topic).filter_by(difficulty_level=user.current_level).all()
-        for topic in all_topics:
-            prerequisites = topic.prerequisites
-            if all(prereq_id in completed_topic_ids for prereq_id in prerequisites):
-                if topic.id not in completed_topic_ids:
-                    recommended.append(topic.title)
-        
-        return recommended[:3]  # Return top 3 recommendations
+        return Lesson(
+            title=result.get('title') or self._extract_title(content),
+            content=content,
+            difficulty=progress["user_level"],
+            related_topics=self._get_related_topics(content),
+            practice_suggestions=[str(s).strip('- ') for s in suggestions if str(s).strip()]
+        )
 
     def _create_lesson_prompt(self, progress: Dict) -> str:
         """Create a prompt for GPT-4 based on user's progress"""
@@ -283,6 +362,11 @@ The lesson should:
 4. Reference previously mastered topics when relevant
 5. Include a small challenge or exercise
 6. Use proper Rust code formatting
+
+Format the response as JSON with these fields:
+- title: A short title for the lesson
+- content: The lesson text, using Markdown for code blocks and emphasis
+- practice_suggestions: A list of 3 short, practical exercises based on the lesson
 """
 
     def _extract_title(self, lesson_content: str) -> str:
@@ -295,24 +379,17 @@ The lesson should:
 
     def _get_related_topics(self, lesson_content: str) -> List[str]:
         """Extract related topics from the lesson content"""
-        common_rust_topics = [
-            "ownership", "borrowing", "lifetimes", "traits", "generics",
-            "error handling", "concurrency", "pattern matching", "structs",
-            "enums", "modules", "testing", "cargo", "memory safety"
-        ]
-        
-        related = []
-        for topic in common_rust_topics:
-            if topic.lower() in lesson_content.lower():
-                related.append(topic)
-        return related
+        found = {match.lower() for match in _RELATED_TOPICS_PATTERN.findall(lesson_content)}
+        return [topic for topic in _COMMON_RUST_TOPICS if topic in found]
 
-    def _generate_practice_suggestions(self, lesson_content: str) -> List[str]:
+    async def _agenerate_practice_suggestions(self, lesson_content: str) -> List[str]:
         """Generate practice exercises based on lesson content.
         
         This function uses OpenAI to create three practical exercises that
-        reinforce the concepts covered in the lesson. If the API call fails,
-        it returns generic practice suggestions.
+        reinforce the concepts covered in the lesson. Lessons normally come
+        with their own suggestions, so it's only a fallback for when the model
+        left them out. If the API call fails, it returns generic practice
+        suggestions.
         
         Args:
             lesson_content (str): The content of the lesson
@@ -321,24 +398,29 @@ The lesson should:
             List[str]: List of practice exercise suggestions
         """
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Generate 3 short, practical exercises based on this Rust lesson."},
-                    {"role": "user", "content": lesson_content}
-                ],
-                temperature=0.7,
-                max_tokens=300
-            )
+            async with self.request_slots, self.limiter:
+                response = await self.async_client.chat.completions.create(
+                    **self._suggestions_request(lesson_content)
+                )
             
             suggestions = response.choices[0].message.content.split('\n')
             return [s.strip('- ') for s in suggestions if s.strip()]
-        except:
-            return ["Practice implementing the concepts shown in the example",
-                   "Try modifying the code to handle different cases",
-                   "Write tests for the implementation"]
+        except Exception:
+            return list(_DEFAULT_PRACTICE_SUGGESTIONS)
 
-    def generate_practice_exercise(self, user_id: str, topic_title: str) -> dict:
+    def _suggestions_request(self, lesson_content: str) -> Dict:
+        """Build the practice suggestions completion arguments"""
+        return {
+            "model": OPENAI_FAST_MODEL,
+            "messages": [
+                {"role": "system", "content": "Generate 3 short, practical exercises based on this Rust lesson."},
+                {"role": "user", "content": lesson_content}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 300
+        }
+
+    async def agenerate_practice_exercise(self, user_id: str, topic_title: str) -> dict:
         """Generate a practice exercise for a specific topic.
         
         Args:
@@ -347,15 +429,25 @@ The lesson should:
             
         Returns:
             dict: A dictionary containing the exercise description and code
+            
+        Raises:
+            OpenAIToolsError: If the user's progress or the exercise can't be fetched
         """
         try:
             # Get user's progress for this topic
-            progress = self.check_user_progress(user_id)
-            if "error" in progress:
-                return {"error": "Could not fetch user progress"}
+            progress = await self.acheck_user_progress(user_id)
+            cache_key = ("exercise", topic_title.strip().casefold(), self._prompt_digest(progress))
+            return await self._generate_once(cache_key, lambda: self._create_exercise(topic_title, progress))
             
-            # Create a prompt for generating a practice exercise
-            prompt = f"""Create a practice exercise for the topic '{topic_title}'.
+        except OpenAIToolsError:
+            raise
+        except Exception as e:
+            raise OpenAIToolsError(str(e)) from e
+    
+    async def _create_exercise(self, topic_title: str, progress: Dict) -> dict:
+        """Request a new practice exercise for a topic at the user's level"""
+        # Create a prompt for generating a practice exercise
+        prompt = f"""Create a practice exercise for the topic '{topic_title}'.
 The user's current level is {progress['user_level']} and they have completed {progress['total_topics']} topics.
 Their strong topics are: {', '.join(progress['strong_topics'])}
 Their weak topics are: {', '.join(progress['weak_topics'])}
@@ -372,40 +464,74 @@ Format the response as JSON with these fields:
 - code: The starting code template
 - hints: Optional hints for solving the exercise
 """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+        
+        async with self.request_slots, self.limiter:
+            response = await self.async_client.chat.completions.create(
+                model=OPENAI_FAST_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a Rust programming expert creating practice exercises."},
                     {"role": "user", "content": prompt}
                 ],
                 response_format={"type": "json_object"}
             )
+        
+        return json.loads(response.choices[0].message.content)
+
+    def _prompt_digest(self, progress: Dict) -> str:
+        """Digest the progress fields the exercise and solution prompts are built from.
+        
+        Two users share a cached exercise or solution only when their prompts
+        would be identical, so one user's strong and weak topics are never
+        reflected in another user's result.
+        
+        Args:
+            progress (Dict): The user's progress report
             
-            exercise = json.loads(response.choices[0].message.content)
-            return exercise
-            
-        except Exception as e:
-            return {"error": str(e)}
-    
-    def generate_solution(self, user_id: str, topic_title: str) -> dict:
-        """Generate a solution for a practice exercise.
+        Returns:
+            str: A stable digest of the level, topic count and strong and weak topics
+        """
+        fields = json.dumps([
+            progress['user_level'],
+            progress['total_topics'],
+            progress['strong_topics'],
+            progress['weak_topics']
+        ])
+        return hashlib.blake2b(fields.encode(), digest_size=16).hexdigest()
+
+    async def _generate_once(self, key: tuple, generate: Callable[[], Awaitable[dict]]) -> dict:
+        """Return a fresh cached exercise or solution, generating it on a miss.
+        
+        Concurrent misses for the same key share one request: the first caller
+        starts it as a task, and every caller awaits that task's result (or error).
+        The task is shielded, so a caller that gives up doesn't cancel it for the rest.
         
         Args:
-            user_id (str): The user's Telegram ID
-            topic_title (str): The title of the topic
+            key (tuple): The generation cache key
+            generate (Callable[[], Awaitable[dict]]): Makes the OpenAI request on a miss
             
         Returns:
-            dict: A dictionary containing the solution explanation and code
+            dict: The cached or newly generated result
         """
-        try:
-            # Get user's progress for this topic
-            progress = self.check_user_progress(user_id)
-            if "error" in progress:
-                return {"error": "Could not fetch user progress"}
+        cached = self.generation_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        pending = self._pending_generations.get(key)
+        if pending is None:
+            pending = self._pending_generations[key] = asyncio.ensure_future(generate())
             
-            # Create a prompt for generating a solution
-            prompt = f"""Create a solution for a practice exercise on the topic '{topic_title}'.
+            def finish(task: asyncio.Task) -> None:
+                del self._pending_generations[key]
+                if not task.cancelled() and task.exception() is None:
+                    self.generation_cache[key] = task.result()
+            
+            pending.add_done_callback(finish)
+        return await asyncio.shield(pending)
+
+    async def _create_solution(self, topic_title: str, progress: Dict) -> dict:
+        """Request a worked solution for a topic's practice exercise at the user's level"""
+        # Create a prompt for generating a solution
+        prompt = f"""Create a solution for a practice exercise on the topic '{topic_title}'.
 The user's current level is {progress['user_level']} and they have completed {progress['total_topics']} topics.
 Their strong topics are: {', '.join(progress['strong_topics'])}
 Their weak topics are: {', '.join(progress['weak_topics'])}
@@ -422,18 +548,65 @@ Format the response as JSON with these fields:
 - code: The complete solution code
 - alternatives: Optional alternative approaches
 """
-            
-            response = self.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
+        
+        async with self.request_slots, self.limiter:
+            response = await self.async_client.chat.completions.create(
+                model=OPENAI_FAST_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a Rust programming expert explaining solutions."},
                     {"role": "user", "content": prompt}
                 ],
                 response_format={"type": "json_object"}
             )
+        
+        return json.loads(response.choices[0].message.content)
+
+    async def agenerate_solution(self, user_id: str, topic_title: str) -> dict:
+        """Generate a solution for a practice exercise.
+        
+        Args:
+            user_id (str): The user's Telegram ID
+            topic_title (str): The title of the topic
+            
+        Returns:
+            dict: A dictionary containing the solution explanation and code
             
-            solution = json.loads(response.choices[0].message.content)
-            return solution
+        Raises:
+            OpenAIToolsError: If the user's progress or the solution can't be fetched
+        """
+        try:
+            # Get user's progress for this topic
+            progress = await self.acheck_user_progress(user_id)
+            cache_key = ("solution", topic_title.strip().casefold(), self._prompt_digest(progress))
+            return await self._generate_once(cache_key, lambda: self._create_solution(topic_title, progress))
             
+        except OpenAIToolsError:
+            raise
         except Exception as e:
-            return {"error": str(e)} 
\ No newline at end of file
+            raise OpenAIToolsError(str(e)) from e
+
+@lru_cache(maxsize=4096)
+def _progress_summary(
+    user_level: str,
+    total_topics: int,
+    strong_topics: tuple,
+    weak_topics: tuple,
+    average_mastery: float
+) -> str:
+    """Describe a user's progress for the chat prompt.
+    
+    A user's progress rarely changes between messages, so the rendered text
+    is kept per distinct progress rather than formatted on every turn.
+    """
+    return f"""You are a helpful Rust programming tutor. The user's current level is {user_level} 
+and they have completed {total_topics} topics. Their strong topics are: {', '.join(strong_topics)} 
+and weak topics are: {', '.join(weak_topics)}. Their average mastery level is {average_mastery:.1%}."""
+
+@lru_cache(maxsize=1)
+def get_openai_tools() -> OpenAITools:
+    """Return the process-wide OpenAITools instance, created on first use.
+    
+    Sharing one instance keeps the OpenAI clients' keep-alive connections and
+    the rate limiter alive across messages and button presses.
+    """
+    return OpenAITools()